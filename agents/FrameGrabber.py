@@ -0,0 +1,96 @@
+import threading
+from typing import Optional
+
+import cv2
+import numpy as np
+
+try:
+    # libjpeg-turbo's SIMD encoder is noticeably faster than cv2.imencode's generic path
+    from turbojpeg import TurboJPEG
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):  # PyTurboJPEG or the libturbojpeg library is missing
+    _turbo_jpeg = None
+
+
+def encode_jpeg(frame: np.ndarray, quality: int = 70) -> bytes:
+    """JPEG-encode a BGR frame, using libjpeg-turbo when available"""
+    if _turbo_jpeg is not None:
+        return _turbo_jpeg.encode(frame, quality=quality)
+    _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return buffer.tobytes()
+
+
+def scene_hash(frame: np.ndarray) -> int:
+    """64-bit average hash of a BGR frame; nearby scenes differ in only a few bits"""
+    gray = cv2.cvtColor(cv2.resize(frame, (8, 8), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    bits = (gray > gray.mean()).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hash_distance(a: int, b: int) -> int:
+    """Hamming distance between two scene hashes"""
+    return bin(a ^ b).count("1")
+
+
+def open_camera(index=0, width=640, height=480, fps=30):
+    """
+    Open a webcam configured for low latency: MJPG transfer (far less USB bandwidth
+    than raw YUYV) and a 1-frame driver buffer so reads never return stale frames.
+    """
+    cap = cv2.VideoCapture(index)
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    cap.set(cv2.CAP_PROP_FPS, fps)
+    return cap
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Continuously pulls frames from a cv2.VideoCapture on a daemon thread and keeps
+    only the most recent one, so consumers never block on camera I/O or read a
+    stale frame out of the driver's buffer.
+    """
+
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.lock = threading.Lock()
+        self.latest: Optional[np.ndarray] = None
+        self.frame_id = 0
+        self.failed = False
+        self._first_frame = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if not self.cap.grab():
+                self.failed = True
+                self._first_frame.set()
+                break
+            ret, frame = self.cap.retrieve()
+            if not ret:
+                continue
+            with self.lock:
+                self.latest = frame
+                self.frame_id += 1
+            self._first_frame.set()
+
+    def read(self, timeout: float = 2.0, copy: bool = True) -> Optional[np.ndarray]:
+        """
+        Return the latest frame, or None if no frame is available. Each retrieve fills a
+        new array, so copy=False is safe for callers that don't modify the frame.
+        """
+        if not self._first_frame.wait(timeout):
+            return None
+        with self.lock:
+            if self.latest is None:
+                return None
+            return self.latest.copy() if copy else self.latest
+
+    def stop(self):
+        """Stop the reader thread and wait for it to exit"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=1.0)
@@ -0,0 +1,62 @@
+import json
+import os
+import queue
+import threading
+from typing import Optional
+
+try:
+    import sounddevice as sd
+    from vosk import KaldiRecognizer, Model, SetLogLevel
+except (ImportError, OSError):  # vosk, sounddevice or PortAudio is missing
+    sd = None
+    KaldiRecognizer = Model = SetLogLevel = None
+
+
+class OfflineListener:
+    """
+    Transcribes the microphone continuously with Vosk. Audio is fed to the recognizer
+    from PortAudio's callback thread, and finished phrases are queued. There is no
+    per-utterance ambient-noise calibration and no network round-trip.
+    """
+
+    def __init__(self, model_path: str, samplerate: int = 16000):
+        SetLogLevel(-1)
+        self.recognizer = KaldiRecognizer(Model(model_path), samplerate)
+        self.lock = threading.Lock()
+        self.phrases: "queue.Queue[str]" = queue.Queue()
+        self.stream = sd.RawInputStream(samplerate=samplerate, blocksize=4000, dtype='int16',
+                                        channels=1, callback=self._on_audio)
+
+    @staticmethod
+    def available(model_path: str) -> bool:
+        """True if vosk/sounddevice are installed and the model directory exists"""
+        return Model is not None and os.path.isdir(model_path)
+
+    def _on_audio(self, indata, frames, time_info, status):
+        with self.lock:
+            if not self.recognizer.AcceptWaveform(bytes(indata)):
+                return
+            text = json.loads(self.recognizer.Result()).get("text", "")
+        if text:
+            self.phrases.put(text)
+
+    def start(self):
+        self.stream.start()
+
+    def listen(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Return the next recognized phrase, or None if nothing was said within timeout"""
+        try:
+            return self.phrases.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        """Discard queued phrases and any partial utterance (e.g. the robot's own speech)"""
+        with self.lock:
+            self.recognizer.Reset()
+            while not self.phrases.empty():
+                self.phrases.get_nowait()
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
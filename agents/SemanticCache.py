@@ -0,0 +1,84 @@
+import re
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # fall back to exact matching on normalized text
+    SentenceTransformer = None
+
+from agents.FrameGrabber import hash_distance
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+# Tokens that change which motion a command asks for; embeddings barely separate them
+_MOTION_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|\b(?:left|right|up|down|forward|backward|back)\b")
+
+
+class _Entry(NamedTuple):
+    key: Any
+    tokens: tuple
+    scene: int
+    state: tuple
+    response: Dict[str, Any]
+    created: float
+
+
+class SemanticCache:
+    """
+    Reuses a previous structured model response when a new command means the same thing
+    (cosine similarity of MiniLM embeddings >= threshold, with identical numbers and
+    directions) and the robot is in the same state looking at roughly the same scene
+    (average-hash Hamming distance).
+    Without sentence-transformers installed, commands must match after normalization.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_scene_distance: int = 6,
+                 max_entries: int = 64, ttl: float = 300.0):
+        self.threshold = threshold
+        self.max_scene_distance = max_scene_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: List[_Entry] = []
+        self.model = SentenceTransformer(EMBEDDING_MODEL) if SentenceTransformer else None
+
+    def embed(self, text: str):
+        """
+        Cache key for a command: a unit-length embedding (or the normalized text) paired
+        with its numbers and directions, which must match exactly
+        """
+        tokens = tuple(_MOTION_TOKEN_RE.findall(text.lower()))
+        if self.model is None:
+            return _NON_WORD_RE.sub(" ", text.lower()).strip(), tokens
+        return self.model.encode(text, normalize_embeddings=True), tokens
+
+    def _similarity(self, a, b) -> float:
+        if self.model is None:
+            return 1.0 if a == b else 0.0
+        return float(np.dot(a, b))
+
+    def lookup(self, key, scene: int, state: Dict[str, int]) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a matching command/scene/state, or None"""
+        key, tokens = key
+        state = tuple(sorted(state.items()))
+        now = time.monotonic()
+        with self.lock:
+            self.entries = [e for e in self.entries if now - e.created < self.ttl]
+            best, best_score = None, self.threshold
+            for entry in self.entries:
+                if entry.tokens != tokens or entry.state != state or hash_distance(entry.scene, scene) > self.max_scene_distance:
+                    continue
+                score = self._similarity(key, entry.key)
+                if score >= best_score:
+                    best, best_score = entry, score
+        return best.response if best else None
+
+    def store(self, key, scene: int, state: Dict[str, int], response: Dict[str, Any]):
+        key, tokens = key
+        with self.lock:
+            self.entries.append(_Entry(key, tokens, scene, tuple(sorted(state.items())), response, time.monotonic()))
+            del self.entries[:-self.max_entries]
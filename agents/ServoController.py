@@ -1,6 +1,6 @@
 import serial
 import time
-from typing import Dict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 MIN_STEPPER_DEG = -180
 MAX_STEPPER_DEG = 180
@@ -10,6 +10,11 @@ FULL_STEPS_PER_REV = 200  # typical NEMA17
 STEPS_PER_REV = FULL_STEPS_PER_REV * MICROSTEP
 STEPS_PER_DEG = STEPS_PER_REV / 360.0
 
+# Approximate motion speeds, used to estimate when a commanded move has finished
+STEPPER_DEG_PER_SEC = 45.0
+SERVO_UNITS_PER_SEC = 50.0
+MOTION_SETTLE_SEC = 0.2  # minimum time for any move to settle
+
 class ServoController:
     def __init__(self, port='/dev/tty.usbmodem1101', baud=9600, delay=2):
         self.port = port
@@ -22,6 +27,8 @@ class ServoController:
         self.rotation_stepper_deg = 0
         self.translation_servo_pos = 0
         self.max_servo_change = 20  # Hardware safety limit
+        self.busy_until = 0.0  # time.monotonic() at which the last commanded move should be done
+        self._batch: Optional[List[str]] = None  # commands queued by execute_batch
         self._connect()
 
     def _connect(self):
@@ -46,6 +53,46 @@ class ServoController:
             target_change = self.max_servo_change if target_change > 0 else -self.max_servo_change
         return target_change
 
+    def _mark_busy(self, duration: float):
+        """Extend the estimated busy window by the duration of a newly queued move"""
+        start = max(self.busy_until, time.monotonic())
+        self.busy_until = start + max(MOTION_SETTLE_SEC, duration)
+
+    def is_moving(self) -> bool:
+        """True while a previously commanded move is estimated to still be running"""
+        return time.monotonic() < self.busy_until
+
+    def wait_until_idle(self, timeout=None):
+        """Block until the estimated end of the current motion (or timeout seconds)"""
+        remaining = self.busy_until - time.monotonic()
+        if timeout is not None:
+            remaining = min(remaining, timeout)
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _send(self, command: str):
+        """Write a command, or queue it while a batch is being built"""
+        if self._batch is not None:
+            self._batch.append(command)
+        else:
+            self.arduino.write(command.encode())
+
+    def execute_batch(self, calls: Iterable[Tuple[Callable, tuple]]) -> bool:
+        """
+        Run several move calls (bound method, args) and transmit all of their commands
+        in one serial write, so the firmware gets the whole sequence without a round-trip
+        per move. Position tracking and busy estimates are updated as usual.
+        """
+        self._batch = []
+        try:
+            for method, args in calls:
+                method(*args)
+        finally:
+            pending, self._batch = self._batch, None
+            if pending and self.arduino is not None:
+                self.arduino.write("".join(pending).encode())
+        return True
+
     def move_servo(self, channel, value):
         if self.arduino is None:
             print("No Arduino connected.")
@@ -56,8 +103,16 @@ class ServoController:
             return False
 
         command = f"s:{channel}:{value}\n"
-        self.arduino.write(command.encode())
+        self._send(command)
         print(f"[?] Sent servo: {command.strip()}")
+
+        if channel == self.elevation_motor_port:
+            distance = abs(value - self.elevation_servo_pos)
+        elif channel == self.translation_motor_port:
+            distance = abs(value - self.translation_servo_pos)
+        else:
+            distance = self.max_servo_change
+        self._mark_busy(distance / SERVO_UNITS_PER_SEC)
         return True
 
     def set_elevation(self, value):
@@ -84,6 +139,22 @@ class ServoController:
                 return True
         return False
 
+    def move_up(self, amount):
+        """Raise elevation by amount (relative, clamped to 0-100)"""
+        return self.set_elevation(self.elevation_servo_pos + abs(amount))
+
+    def move_down(self, amount):
+        """Lower elevation by amount (relative, clamped to 0-100)"""
+        return self.set_elevation(self.elevation_servo_pos - abs(amount))
+
+    def move_forward(self, amount):
+        """Extend translation by amount (relative, clamped to 0-100)"""
+        return self.set_translation(self.translation_servo_pos + abs(amount))
+
+    def move_backward(self, amount):
+        """Retract translation by amount (relative, clamped to 0-100)"""
+        return self.set_translation(self.translation_servo_pos - abs(amount))
+
     def move_left(self, degrees):
         """Rotate stepper left by degrees with validation"""
         new_rotation = self._clamp_rotation(self.rotation_stepper_deg - abs(degrees))
@@ -129,8 +200,9 @@ class ServoController:
         else:
             return False
 
-        self.arduino.write(command.encode())
+        self._send(command)
         print(f"[?] Sent stepper: {command.strip()}")
+        self._mark_busy(abs(degrees) / STEPPER_DEG_PER_SEC)
         return True
 
     def hold_position(self, seconds):
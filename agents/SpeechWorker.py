@@ -0,0 +1,146 @@
+import os
+import queue
+import tempfile
+import threading
+import wave
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pyttsx3
+
+try:
+    import sounddevice as sd
+except (ImportError, OSError):  # sounddevice or PortAudio is missing; phrases are synthesized live
+    sd = None
+
+try:
+    # Piper streams PCM while it synthesizes, so audio starts after the first chunk
+    from piper.voice import PiperVoice
+except ImportError:
+    PiperVoice = None
+
+
+class SpeechWorker(threading.Thread):
+    """
+    Owns the TTS engine on a daemon thread and speaks queued text in order.
+    runAndWait isn't safe to call from several threads at once, so everything that
+    talks (replies, early first sentences, timed follow-ups) goes through say().
+
+    cached_phrases are rendered to audio once at startup and played back directly,
+    skipping synthesis for fixed replies like "Ready".
+
+    If piper_model points to a Piper .onnx voice (and piper-tts and sounddevice are
+    installed), speech is synthesized with Piper and streamed to the output device
+    chunk by chunk instead of going through pyttsx3's blocking runAndWait.
+    """
+
+    def __init__(self, rate: Optional[int] = None, volume: Optional[float] = None,
+                 voice_index: Optional[int] = None, cached_phrases: Iterable[str] = (),
+                 piper_model: Optional[str] = None):
+        super().__init__(daemon=True)
+        self.rate = rate
+        self.volume = volume
+        self.voice_index = voice_index
+        self.cached_phrases = tuple(cached_phrases)
+        self.piper_model = piper_model
+        self._clips: Dict[str, Tuple[np.ndarray, int]] = {}
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+
+    def _prerender(self, engine):
+        """Synthesize cached_phrases to WAV files and keep the decoded samples in memory"""
+        if sd is None or not self.cached_phrases:
+            return
+        cache_dir = tempfile.mkdtemp(prefix="tts_cache_")
+        paths = {}
+        for i, phrase in enumerate(self.cached_phrases):
+            paths[phrase] = os.path.join(cache_dir, f"{i}.wav")
+            engine.save_to_file(phrase, paths[phrase])
+        engine.runAndWait()
+
+        for phrase, path in paths.items():
+            try:
+                with wave.open(path, 'rb') as clip:
+                    if clip.getsampwidth() != 2:
+                        continue
+                    samples = np.frombuffer(clip.readframes(clip.getnframes()), dtype=np.int16)
+                    self._clips[phrase] = (samples.reshape(-1, clip.getnchannels()), clip.getframerate())
+            except (OSError, EOFError, wave.Error):
+                # Some drivers (e.g. macOS) write AIFF regardless of extension; speak those live
+                pass
+
+    def _load_piper(self):
+        """Return (voice, started output stream), or None to fall back to pyttsx3"""
+        if not (self.piper_model and PiperVoice and sd and os.path.exists(self.piper_model)):
+            return None
+        try:
+            voice = PiperVoice.load(self.piper_model)
+            stream = sd.RawOutputStream(samplerate=voice.config.sample_rate, channels=1, dtype='int16')
+            stream.start()
+        except Exception as e:
+            print(f"Piper unavailable ({e}); using pyttsx3")
+            return None
+        return voice, stream
+
+    def run(self):
+        piper = self._load_piper()
+        if piper is not None:
+            self._run_loop(lambda text: self._speak_piper(*piper, text))
+            piper[1].close()
+            return
+
+        # Voice properties are set once here instead of before every utterance
+        engine = pyttsx3.init()
+        if self.rate is not None:
+            engine.setProperty('rate', self.rate)
+        if self.volume is not None:
+            engine.setProperty('volume', self.volume)
+        voices = engine.getProperty('voices')
+        if self.voice_index is not None and voices:
+            engine.setProperty('voice', voices[self.voice_index].id)
+        self._prerender(engine)
+        self._run_loop(lambda text: self._speak_pyttsx3(engine, text))
+
+    def _speak_pyttsx3(self, engine, text: str):
+        clip = self._clips.get(text)
+        if clip is not None:
+            sd.play(*clip)
+            sd.wait()
+        else:
+            engine.say(text)
+            engine.runAndWait()
+
+    @staticmethod
+    def _speak_piper(voice, stream, text: str):
+        if hasattr(voice, 'synthesize_stream_raw'):  # piper-tts < 1.3
+            for audio in voice.synthesize_stream_raw(text):
+                stream.write(audio)
+            return
+        for chunk in voice.synthesize(text):  # piper-tts 1.3+: one AudioChunk per sentence
+            stream.write(chunk.audio_int16_bytes)
+
+    def _run_loop(self, speak):
+        while True:
+            text = self._queue.get()
+            try:
+                if text is None:
+                    return
+                speak(text)
+            except Exception as e:
+                print(f"TTS error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def say(self, text: str):
+        """Queue text to be spoken; returns immediately"""
+        if text:
+            self._queue.put(text)
+
+    def wait_until_done(self):
+        """Block until everything queued so far has been spoken"""
+        self._queue.join()
+
+    def stop(self, timeout: float = 5.0):
+        """Finish the queued speech (up to timeout seconds) and stop the worker"""
+        self._queue.put(None)
+        if self.is_alive():
+            self.join(timeout=timeout)
@@ -1,72 +1,174 @@
 import mediapipe as mp
 import cv2
 import numpy as np
+import os
 import time
+import atexit
+import threading
+import urllib.request
+from typing import List, NamedTuple
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
 
 from agents.ServoController import ServoController
+from agents.FrameGrabber import FrameGrabber, open_camera
 
 sc = ServoController()
 
-# Initialize MediaPipe Face Detection (BlazeFace)
-mp_face_detection = mp.solutions.face_detection
-mp_drawing = mp.solutions.drawing_utils
+# Make sure OpenCV uses its SIMD (universal intrinsics) code paths for cvtColor/resize/imencode.
+# Prebuilt opencv-python wheels ship with AVX2 (x86) / NEON (ARM) dispatch. On a source build
+# (e.g. Raspberry Pi), configure with -DCPU_BASELINE=NEON -DCPU_DISPATCH=NEON_FP16,NEON_DOTPROD
+# or -DCPU_BASELINE=AVX2 -DCPU_DISPATCH=AVX512_SKX so these stay vectorized.
+cv2.setUseOptimized(True)
+
+def check_opencv_simd():
+    """Warn if the installed OpenCV build lacks the SIMD extensions the vision path relies on"""
+    simd_flags = [getattr(cv2, name) for name in ("CPU_AVX2", "CPU_NEON") if hasattr(cv2, name)]
+    if not any(cv2.checkHardwareSupport(flag) for flag in simd_flags):
+        print("⚠️ OpenCV is running without AVX2/NEON; frame preprocessing will be slower. "
+              "See cv2.getBuildInformation() for the enabled CPU features.")
+
+check_opencv_simd()
+
+# Initialize MediaPipe Face Detection (BlazeFace) via the Tasks API, which takes an mp.Image
+# wrapping our RGB buffer directly instead of copying an ndarray through the legacy Solutions graph
+BaseOptions = mp.tasks.BaseOptions
+FaceDetector = mp.tasks.vision.FaceDetector
+FaceDetectorOptions = mp.tasks.vision.FaceDetectorOptions
+VisionRunningMode = mp.tasks.vision.RunningMode
+
+# Short-range (2m) BlazeFace model, downloaded on first use
+FACE_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'blaze_face_short_range.tflite')
+FACE_MODEL_URL = "https://storage.googleapis.com/mediapipe-models/face_detector/blaze_face_short_range/float16/latest/blaze_face_short_range.tflite"
+
+
+class FaceBox(NamedTuple):
+    """A detected face: bounding box relative to the frame (0-1) and its confidence"""
+    xmin: float
+    ymin: float
+    width: float
+    height: float
+    score: float
+
+
+def _ensure_face_model():
+    """Download the BlazeFace model if it isn't present yet"""
+    if not os.path.exists(FACE_MODEL_PATH):
+        print(f"Downloading face detection model to {FACE_MODEL_PATH}...")
+        os.makedirs(os.path.dirname(FACE_MODEL_PATH), exist_ok=True)
+        urllib.request.urlretrieve(FACE_MODEL_URL, FACE_MODEL_PATH)
+    return FACE_MODEL_PATH
+
+# Shared face detection instance; building the graph is expensive so it's created once
+_face_detection = None
+_face_detection_lock = threading.Lock()
 
 def get_face_detection():
-    """Get a fresh face detection instance"""
-    return mp_face_detection.FaceDetection(
-        model_selection=0,  # 0 for short-range (2m), 1 for full-range (5m)
-        min_detection_confidence=0.9
-    )
+    """Get the shared face detection instance, creating it on first use"""
+    global _face_detection
+    with _face_detection_lock:
+        if _face_detection is None:
+            _face_detection = FaceDetector.create_from_options(FaceDetectorOptions(
+                # The Tasks CPU delegate runs the model through XNNPACK (NEON/AVX kernels)
+                base_options=BaseOptions(model_asset_path=_ensure_face_model(),
+                                         delegate=BaseOptions.Delegate.CPU),
+                running_mode=VisionRunningMode.IMAGE,
+                min_detection_confidence=0.9
+            ))
+        return _face_detection
 
-def detect_faces(image, face_detection_instance):
+def _close_face_detection():
+    """Release the shared face detection instance at process exit"""
+    global _face_detection
+    with _face_detection_lock:
+        if _face_detection is not None:
+            _face_detection.close()
+            _face_detection = None
+
+atexit.register(_close_face_detection)
+
+# BlazeFace runs at 128x128 internally, so detect on a downscaled frame.
+# Bounding boxes are relative (0-1), so geometry still uses the full-size frame shape.
+DETECTION_SIZE = (320, 240)
+
+# Generous wall-clock allowance per centering iteration: a detection, a move of up to 1.5s,
+# and a share of the occasional look-around
+ITERATION_TIME_BUDGET = 2.0
+# Treat the camera as failed if it delivers no new frame for this long (e.g. a stalled USB read)
+FRAME_STALL_TIMEOUT = 2.0
+
+def downscale_for_detection(frame):
+    """Shrink a frame to DETECTION_SIZE before running face detection"""
+    return cv2.resize(frame, DETECTION_SIZE, interpolation=cv2.INTER_AREA)
+
+# Reused RGB conversion buffer so each frame doesn't allocate a new image
+_rgb_buffer = None
+
+def detect_faces(image, face_detection_instance) -> List[FaceBox]:
     """
     Detect faces in an image using BlazeFace
-    Returns: List of face detection results
+    Returns: List of FaceBox with coordinates relative to the image
     """
-    # Convert BGR to RGB
-    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    global _rgb_buffer
+
+    # Convert BGR to RGB into the preallocated buffer (reallocated only if the frame size changes)
+    if _rgb_buffer is None or _rgb_buffer.shape != image.shape:
+        _rgb_buffer = np.empty_like(image)
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=_rgb_buffer)
     
-    # Process the image
-    results = face_detection_instance.process(rgb_image)
+    # Wrap the contiguous RGB buffer as an mp.Image (no extra ndarray copy) and detect
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=_rgb_buffer)
+    results = face_detection_instance.detect(mp_image)
     
-    return results.detections if results.detections else []
+    # Tasks API boxes are in pixels of the detection image; normalize them so
+    # callers can map onto any frame size
+    h, w = image.shape[:2]
+    faces = []
+    for detection in results.detections:
+        bbox = detection.bounding_box
+        faces.append(FaceBox(bbox.origin_x / w, bbox.origin_y / h, bbox.width / w, bbox.height / h,
+                             detection.categories[0].score))
+    return faces
 
 def draw_face_detections(image, detections):
     """
     Draw bounding boxes around detected faces
     """
     if detections:
-        for detection in detections:
-            # Get bounding box
-            bbox = detection.location_data.relative_bounding_box
+        for face in detections:
             h, w, _ = image.shape
             
             # Convert relative coordinates to absolute
-            x = int(bbox.xmin * w)
-            y = int(bbox.ymin * h)
-            width = int(bbox.width * w)
-            height = int(bbox.height * h)
+            x = int(face.xmin * w)
+            y = int(face.ymin * h)
+            width = int(face.width * w)
+            height = int(face.height * h)
             
             # Draw rectangle
             cv2.rectangle(image, (x, y), (x + width, y + height), (0, 255, 0), 2)
             
             # Draw confidence score
-            confidence = detection.score[0]
+            confidence = face.score
             cv2.putText(image, f'Face: {confidence:.2f}', 
                        (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
     
     return image
 
-def get_face_center(detection, image_shape):
+def get_face_center(face, image_shape):
     """
     Get the center point of a detected face
     """
-    bbox = detection.location_data.relative_bounding_box
     h, w = image_shape[:2]
     
     # Calculate center coordinates
-    center_x = int((bbox.xmin + bbox.width/2) * w)
-    center_y = int((bbox.ymin + bbox.height/2) * h)
+    center_x = int((face.xmin + face.width/2) * w)
+    center_y = int((face.ymin + face.height/2) * h)
     
     return (center_x, center_y)
 
@@ -120,12 +222,32 @@ def calculate_face_vertical_offset(face_center, image_shape, fov_degrees=60):
     
     return angle_degrees
 
+@njit(cache=True)
+def face_geometry(xmin, ymin, bw, bh, h, w, fov_degrees):
+    """
+    Compiled equivalent of get_face_center + calculate_face_angle + calculate_face_vertical_offset
+    Args:
+        xmin, ymin, bw, bh: Relative bounding box (0-1)
+        h, w: Frame height and width in pixels
+        fov_degrees: Field of view in degrees
+    Returns:
+        (center_x, center_y, horizontal_angle, vertical_angle)
+    """
+    center_x = int((xmin + bw / 2) * w)
+    center_y = int((ymin + bh / 2) * h)
+    horizontal_angle = ((center_x - w // 2) / w) * fov_degrees
+    vertical_angle = ((center_y - h // 2) / h) * fov_degrees
+    return center_x, center_y, horizontal_angle, vertical_angle
+
+# Warm up (and compile, when numba is available) at import time rather than on the first frame
+face_geometry(0.0, 0.0, 0.0, 0.0, 1, 1, 60.0)
+
 def get_face_angle_from_frame(frame, face_detection_instance):
     """
     Get the angle of the first detected face in a frame
     Returns: Angle in degrees (negative = left, positive = right), or None if no face detected
     """
-    detections = detect_faces(frame, face_detection_instance)
+    detections = detect_faces(downscale_for_detection(frame), face_detection_instance)
     if detections:
         center = get_face_center(detections[0], frame.shape)
         return calculate_face_angle(center, frame.shape)
@@ -179,23 +301,29 @@ def look_around():
     print("Look around complete!")
 
 
-def run_face_detection(max_iterations=50, center_threshold=5):
+def run_face_detection(max_iterations=50, center_threshold=5, frame_skip=1, display=False):
     """
     Run real-time face detection and center on face
     Args:
         max_iterations: Maximum number of iterations before giving up
         center_threshold: Angular threshold in degrees to consider face "centered"
+        frame_skip: Number of camera frames to skip between detections (0 = every frame)
+        display: Draw annotations and show the frame in a window (drawing is skipped otherwise)
     """
     # Initialize webcam
-    cap = cv2.VideoCapture(0)
+    cap = open_camera(0)
     
     if not cap.isOpened():
         print("Error: Could not open webcam")
         return
     
+    # Read frames on a background thread so detection always sees the latest one
+    grabber = FrameGrabber(cap)
+    grabber.start()
+    
     print("BlazeFace Face Detection Started!")
     
-    # Create a fresh face detection instance
+    # Reuse the shared face detection instance
     face_detection = get_face_detection()
     
     iterations = 0
@@ -204,79 +332,108 @@ def run_face_detection(max_iterations=50, center_threshold=5):
     required_consecutive = 3  # Need face centered for 3 consecutive frames
     no_face_threshold = 5  # Number of consecutive frames with no face before looking around
     face_centered_successfully = False
+    last_frame_id = 0
+    newest_frame_id, newest_frame_time = 0, time.monotonic()  # for spotting a stalled camera
+    h = w = None  # Frame size is fixed for the session; read it from the first frame
+    # Waits for the motors or for new frames don't count as iterations, so also bound the wall time
+    deadline = time.monotonic() + max_iterations * ITERATION_TIME_BUDGET
     
     try:
         while iterations < max_iterations and not face_centered_successfully:
-            ret, frame = cap.read()
-            if not ret:
+            if time.monotonic() > deadline:
+                print("Face centering timed out.")
+                break
+            
+            # Frames captured mid-move are blurred and from the wrong viewpoint; don't detect on them
+            if sc.is_moving():
+                time.sleep(0.01)
+                continue
+            
+            # Only run detection on every (frame_skip + 1)-th new camera frame
+            if not grabber.failed and grabber.frame_id - last_frame_id <= frame_skip:
+                if grabber.frame_id != newest_frame_id:
+                    newest_frame_id, newest_frame_time = grabber.frame_id, time.monotonic()
+                elif time.monotonic() - newest_frame_time > FRAME_STALL_TIMEOUT:
+                    print("Error: Camera stopped producing frames")
+                    break
+                time.sleep(0.005)
+                continue
+            last_frame_id = grabber.frame_id
+            
+            frame = grabber.read()
+            if frame is None or grabber.failed:
                 print("Error: Could not read frame")
                 break
             
-            # Detect faces
-            detections = detect_faces(frame, face_detection)
+            # Detect faces on a downscaled copy
+            detections = detect_faces(downscale_for_detection(frame), face_detection)
             
-            # Draw detections
-            frame = draw_face_detections(frame, detections)
+            if w is None:
+                h, w = frame.shape[:2]
             
-            # Draw center line
-            h, w = frame.shape[:2]
-            center_x = w // 2
-            cv2.line(frame, (center_x, 0), (center_x, h), (255, 0, 0), 2)  # Blue center line
+            if display:
+                # Draw detections
+                frame = draw_face_detections(frame, detections)
+                
+                # Draw center line
+                cv2.line(frame, (w // 2, 0), (w // 2, h), (255, 0, 0), 2)  # Blue center line
             
             # Print face information and calculate angles
             if detections:
                 consecutive_no_face = 0  # Reset no-face counter
                 print(f"Detected {len(detections)} face(s)")
-                for i, detection in enumerate(detections):
-                    center = get_face_center(detection, frame.shape)
-                    confidence = detection.score[0]
-                    horizontal_angle = calculate_face_angle(center, frame.shape)
-                    vertical_angle = calculate_face_vertical_offset(center, frame.shape)
-                    
-                    # Determine horizontal direction
-                    if horizontal_angle < 0:
-                        h_direction = f"{abs(horizontal_angle):.1f}° left"
-                    elif horizontal_angle > 0:
-                        h_direction = f"{horizontal_angle:.1f}° right"
-                    else:
-                        h_direction = "center"
-                    
-                    # Determine vertical direction
-                    if vertical_angle < 0:
-                        v_direction = f"{abs(vertical_angle):.1f}° up"
-                    elif vertical_angle > 0:
-                        v_direction = f"{vertical_angle:.1f}° down"
-                    else:
-                        v_direction = "center"
-                    
-                    print(f"Face {i+1}: Center={center}, Confidence={confidence:.3f}, H: {h_direction}, V: {v_direction}")
-                    
-                    # Draw angle text on frame
+                # Only the most confident face drives the motors, so skip geometry for the rest
+                scores = np.fromiter((face.score for face in detections), dtype=np.float32, count=len(detections))
+                primary = int(np.argmax(scores))
+                face = detections[primary]
+                center_x, center_y, horizontal_angle, vertical_angle = face_geometry(
+                    face.xmin, face.ymin, face.width, face.height, h, w, 60.0)
+                center = (center_x, center_y)
+                confidence = scores[primary]
+                
+                # Determine horizontal direction
+                if horizontal_angle < 0:
+                    h_direction = f"{abs(horizontal_angle):.1f}° left"
+                elif horizontal_angle > 0:
+                    h_direction = f"{horizontal_angle:.1f}° right"
+                else:
+                    h_direction = "center"
+                
+                # Determine vertical direction
+                if vertical_angle < 0:
+                    v_direction = f"{abs(vertical_angle):.1f}° up"
+                elif vertical_angle > 0:
+                    v_direction = f"{vertical_angle:.1f}° down"
+                else:
+                    v_direction = "center"
+                
+                print(f"Face {primary+1}: Center={center}, Confidence={confidence:.3f}, H: {h_direction}, V: {v_direction}")
+                
+                # Draw angle text on frame
+                if display:
                     cv2.putText(frame, f"H: {h_direction}, V: {v_direction}", 
                                (center[0] - 80, center[1] + 30), 
                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
-                    
-                    # Check if face is centered (both horizontal and vertical)
-                    h_centered = abs(horizontal_angle) <= center_threshold
-                    v_centered = abs(vertical_angle) <= center_threshold
-                    
-                    if h_centered and v_centered:
-                        consecutive_centered += 1
-                        print("Face is centered")
-                        if consecutive_centered >= required_consecutive:
-                            print("✅ Face centered successfully! Exiting centering protocol.")
-                            face_centered_successfully = True
-                            break
+                
+                # Check if face is centered (both horizontal and vertical)
+                h_centered = abs(horizontal_angle) <= center_threshold
+                v_centered = abs(vertical_angle) <= center_threshold
+                
+                if h_centered and v_centered:
+                    consecutive_centered += 1
+                    print("Face is centered")
+                    if consecutive_centered >= required_consecutive:
+                        print("✅ Face centered successfully! Exiting centering protocol.")
+                        face_centered_successfully = True
+                else:
+                    consecutive_centered = 0
+                    moved = center_face(horizontal_angle, vertical_angle)
+                    # If we couldn't move (hit limits), keep checking without waiting
+                    if not moved:
+                        print("⚠️ Cannot center - hit movement limits. Proceeding anyway.")
                     else:
-                        consecutive_centered = 0
-                        moved = center_face(horizontal_angle, vertical_angle)
-                        # If we couldn't move (hit limits), give up after a few tries
-                        if not moved:
-                            print("⚠️ Cannot center - hit movement limits. Proceeding anyway.")
-                            break
-                        else:
-                            # Wait for motors to complete movement before next check
-                            time.sleep(1.5)
+                        # Wait for the estimated end of the move instead of a fixed 1.5s
+                        sc.wait_until_idle(timeout=1.5)
             else:
                 print("No faces detected")
                 consecutive_centered = 0
@@ -290,19 +447,20 @@ def run_face_detection(max_iterations=50, center_threshold=5):
                     # Continue searching after looking around
                     time.sleep(0.5)
             
-            # Display frame
-            # cv2.imshow('BlazeFace Face Detection', frame)
-            
-            # Check for 'q' key press
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+            if display:
+                # Display frame
+                cv2.imshow('BlazeFace Face Detection', frame)
+                
+                # Check for 'q' key press
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
             
             iterations += 1
     finally:
         # Cleanup
+        grabber.stop()
         cap.release()
         cv2.destroyAllWindows()
-        face_detection.close()
         print("Face detection completed")
 
 
@@ -1,13 +1,12 @@
 import speech_recognition as sr
-import pyttsx3
+import asyncio
 import google.genai as genai
-from google.genai.types import GenerateContentConfig, SafetySetting, HarmCategory, HarmBlockThreshold
+from google.genai.types import GenerateContentConfig, SafetySetting, HarmCategory, HarmBlockThreshold, Part
 import cv2
-import base64
-import json
 import time
 import os
 import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
@@ -17,12 +16,15 @@ load_dotenv(override=True)
 
 # === IMPORT SERVO CONTROLLER ===
 from agents.ServoController import ServoController
+from agents.reply_parsing import parse_ai_response
+from agents.FrameGrabber import open_camera
+from agents.SpeechWorker import SpeechWorker
+from agents.OfflineListener import OfflineListener
 
 # === ENHANCED VOICE SETUP ===
-engine = pyttsx3.init()
-voices = engine.getProperty('voices')
-rate = engine.getProperty('rate')
-volume = engine.getProperty('volume')
+# One persistent TTS thread instead of a fresh pyttsx3 engine per reply
+speech = SpeechWorker(rate=200, voice_index=0)
+speech.start()
 
 # === GEMINI CLIENT SETUP ===
 client = genai.Client(api_key=os.getenv("API_KEY"))
@@ -59,17 +61,26 @@ pending_followup = None
 followup_timer = None
 
 # === CAMERA SETUP ===
-cam = cv2.VideoCapture(0)
+cam = open_camera(0)
 
+# Frame encoding runs here so it overlaps with speech recognition
+frame_executor = ThreadPoolExecutor(max_workers=2)
 
-def get_frame_data():
+
+def _encode_frame(frame) -> bytes:
+    resized = cv2.resize(frame, (224, 224))
+    # Quality 80 is visually identical at 224x224 and roughly half the size of the default 95
+    _, buffer = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buffer.tobytes()
+
+
+def get_frame_data() -> Optional[Future]:
+    """Capture a frame and start encoding it in the background; returns a Future of the JPEG bytes"""
     ret, frame = cam.read()
     if not ret:
         print("Failed to capture frame.")
         return None
-    resized = cv2.resize(frame, (224, 224))
-    _, buffer = cv2.imencode('.jpg', resized)
-    return base64.b64encode(buffer).decode('utf-8')
+    return frame_executor.submit(_encode_frame, frame)
 
 
 # === MOTION EXECUTION SYSTEM ===
@@ -118,40 +129,6 @@ def execute_motion_sequence(actions: List[Dict[str, Any]]) -> bool:
     return True
 
 
-def parse_ai_response(response_text: str) -> Optional[Dict[str, Any]]:
-    """Parse AI response and extract structured data"""
-    try:
-        # Look for JSON structure in the response
-        start_idx = response_text.find('{')
-        if start_idx == -1:
-            return None
-
-        # Find the matching closing brace
-        brace_count = 0
-        end_idx = -1
-        for i in range(start_idx, len(response_text)):
-            if response_text[i] == '{':
-                brace_count += 1
-            elif response_text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i
-                    break
-
-        if end_idx == -1:
-            return None
-
-        json_str = response_text[start_idx:end_idx + 1]
-        return json.loads(json_str)
-
-    except json.JSONDecodeError as e:
-        print(f"JSON parse error: {e}")
-        return None
-    except Exception as e:
-        print(f"Response parsing error: {e}")
-        return None
-
-
 def schedule_followup(followup_prompt: str, delay: float = 3.0):
     """Schedule a followup prompt after motion completion"""
     global pending_followup, followup_timer
@@ -160,8 +137,7 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
         global pending_followup
         if pending_followup:
             print(f"Follow-up: {pending_followup}")
-            engine.say(pending_followup)
-            engine.runAndWait()
+            speech.say(pending_followup)
             pending_followup = None
 
     if followup_timer:
@@ -171,28 +147,13 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
     followup_timer = threading.Timer(delay, execute_followup)
     followup_timer.start()
 
-def speak_async(text):
-    def _speak():
-        engine.say(text)
-        engine.runAndWait()
-    threading.Thread(target=_speak).start()
-
-def speak(text, rate=200, volume=1.0, voice_index=0):
-    tts = pyttsx3.init()
-    voices = tts.getProperty('voices')
-    tts.setProperty('rate', rate)
-    tts.setProperty('volume', volume)
-    if voices:
-        tts.setProperty('voice', voices[voice_index].id)
-    tts.say(text)
-    tts.runAndWait()
-    tts.stop()
-
 # === ENHANCED GEMINI REQUEST FUNCTION ===
-def get_response(user_input: str) -> str:
+async def get_response(user_input: str, frame_future: Optional[Future] = None) -> str:
     global conversation_history
 
-    frame_data = get_frame_data()
+    if frame_future is None:
+        frame_future = get_frame_data()
+    frame_data = await asyncio.wrap_future(frame_future) if frame_future else None
     if not frame_data:
         return "Camera input failed."
 
@@ -204,17 +165,16 @@ def get_response(user_input: str) -> str:
         {"text": f"User command: {user_input}"},
         {"text": state_info},
         {"text": "Here is the current visual scene."},
-        {"inline_data": {
-            "mime_type": "image/jpeg",
-            "data": frame_data
-        }}
+        Part.from_bytes(data=frame_data, mime_type="image/jpeg")
     ]
 
-    conversation_history.append({"role": "user", "parts": vision_parts})
+    # Send a snapshot; the shared history is only extended once the turn completes
+    user_turn = {"role": "user", "parts": vision_parts}
+    contents = conversation_history + [user_turn]
 
-    response = client.models.generate_content(
+    response = await client.aio.models.generate_content(
         model="gemini-3-flash-preview",
-        contents=conversation_history,
+        contents=contents,
         config=GenerateContentConfig(
             system_instruction=system_prompt,
             temperature=0.8,
@@ -244,27 +204,53 @@ def get_response(user_input: str) -> str:
 
         # Return voice response for TTS
         voice_response = structured_response.get('voice_response', gemini_reply)
-        conversation_history.append({"role": "model", "parts": [{"text": voice_response}]})
+        conversation_history = conversation_history + [user_turn, {"role": "model", "parts": [{"text": voice_response}]}]
         return voice_response
     else:
         # Fallback to original response if parsing fails
-        conversation_history.append({"role": "model", "parts": [{"text": gemini_reply}]})
+        conversation_history = conversation_history + [user_turn, {"role": "model", "parts": [{"text": gemini_reply}]}]
         return gemini_reply
 
 
 # === MAIN LOOP ===
 recognizer = sr.Recognizer()
 
-print("Robot control system initialized. Say 'hey' to start interaction.")
-print("Current robot state:", servo_controller.get_current_state())
+# Vosk transcribes the microphone continuously and offline; without it (or its model)
+# each utterance is recorded with speech_recognition and sent to Google
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH", "vosk-model-small-en-us-0.15")
+offline_listener = OfflineListener(VOSK_MODEL_PATH) if OfflineListener.available(VOSK_MODEL_PATH) else None
 
-while listening:
+
+def listen_for_audio():
+    """Calibrate to ambient noise and record one utterance (blocking)"""
     with sr.Microphone() as source:
         print("Listening...")
         recognizer.adjust_for_ambient_noise(source)
+        return recognizer.listen(source, timeout=7.0)
+
+
+async def main():
+    global sending_to_gemini, pending_followup
+
+    print("Robot control system initialized. Say 'hey' to start interaction.")
+    print("Current robot state:", servo_controller.get_current_state())
+
+    if offline_listener:
+        offline_listener.start()
+        print("Listening offline with Vosk...")
+
+    while listening:
         try:
-            audio = recognizer.listen(source, timeout=7.0)
-            response = recognizer.recognize_google(audio)
+            if offline_listener:
+                response = await asyncio.to_thread(offline_listener.listen, 7.0)
+                if not response:
+                    continue
+                frame_future = get_frame_data() if sending_to_gemini else None
+            else:
+                audio = await asyncio.to_thread(listen_for_audio)
+                # Capture/encode the frame on the executor while speech is being transcribed
+                frame_future = get_frame_data() if sending_to_gemini else None
+                response = await asyncio.to_thread(recognizer.recognize_google, audio)
             print("Heard:", response)
 
             if any(word in response.lower() for word in exit_words):
@@ -285,14 +271,14 @@ while listening:
                     followup_timer.cancel()
                     pending_followup = None
 
-                reply = get_response(response)
-                # engine.setProperty('rate', 200)
-                # engine.setProperty('volume', volume)
-                # engine.setProperty('voice', voices[0].id)
-                # engine.say(reply)
-                # engine.runAndWait()
-                speak(reply, rate=200, volume=volume, voice_index=0)
-
+                reply = await get_response(response, frame_future)
+                # Speech runs off the event loop; the next listen waits for it so the
+                # microphone doesn't pick up the robot's own voice
+                speech.say(reply)
+                await asyncio.to_thread(speech.wait_until_done)
+                if offline_listener:
+                    # The stream kept running while the robot talked; drop what it heard
+                    offline_listener.clear()
 
         except sr.UnknownValueError:
             print("Didn't recognize anything.")
@@ -301,7 +287,15 @@ while listening:
         except Exception as e:
             print(f"Unexpected error: {e}")
 
-# Cleanup
-cam.release()
-cv2.destroyAllWindows()
-servo_controller.close()
\ No newline at end of file
+
+try:
+    asyncio.run(main())
+finally:
+    # Cleanup
+    if offline_listener:
+        offline_listener.close()
+    speech.stop()
+    frame_executor.shutdown(wait=False)
+    cam.release()
+    cv2.destroyAllWindows()
+    servo_controller.close()
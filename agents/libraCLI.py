@@ -1,15 +1,13 @@
 import speech_recognition as sr
-import pyttsx3
 import google.genai as genai
-from google.genai.types import GenerateContentConfig, SafetySetting, HarmCategory, HarmBlockThreshold
+from google.genai.types import GenerateContentConfig, SafetySetting, HarmCategory, HarmBlockThreshold, Part
 import cv2
-import base64
-import json
 import os
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -17,23 +15,19 @@ load_dotenv(override=True)
 
 # === IMPORT SERVO CONTROLLER ===
 from agents.ServoController import ServoController
+from agents.reply_parsing import command_id, extract_first_sentence, parse_ai_response
+from agents.FrameGrabber import FrameGrabber, encode_jpeg, open_camera, scene_hash
+from agents.SpeechWorker import SpeechWorker
+from agents.SemanticCache import SemanticCache
 
 # === ENHANCED VOICE SETUP ===
-engine = pyttsx3.init()
-voices = engine.getProperty('voices')
-rate = engine.getProperty('rate')
-volume = engine.getProperty('volume')
+# Single TTS thread; replies and follow-ups are queued so they never talk over each other
+speech = SpeechWorker(rate=200, voice_index=0)
+speech.start()
 
 # === GEMINI CLIENT SETUP ===
 client = genai.Client(api_key=os.getenv("API_KEY"))
 
-generation_config = GenerateContentConfig(
-    temperature=0.8,
-    top_p=0.9,
-    top_k=40,
-    max_output_tokens=8192,
-)
-
 # === SYSTEM PROMPT ===
 try:
     # Use absolute path relative to project root
@@ -46,6 +40,15 @@ except FileNotFoundError:
 
 print("System prompt loaded successfully." if system_prompt else "Error: System prompt not found.")
 
+# Built once; the system prompt never changes during a session
+generation_config = GenerateContentConfig(
+    system_instruction=system_prompt,
+    temperature=0.8,
+    top_p=0.9,
+    top_k=40,
+    max_output_tokens=8192,
+)
+
 # === ROBOT CONTROLLER INITIALIZATION ===
 servo_controller = ServoController()
 
@@ -55,139 +58,105 @@ sending_to_gemini = False
 exit_words = ["exit", "stop", "quit", "bye", "goodbye"]
 pending_followup = None
 followup_timer = None
+# Past turns are resent every request, so cap them (user + model messages)
+MAX_HISTORY_MESSAGES = 40
 
 # === CAMERA SETUP ===
-cam = cv2.VideoCapture(0)
+# Frames are shrunk to 224x224 anyway, so have the camera deliver small MJPG frames
+cam = open_camera(0, width=320, height=240)
+
+# Keep the freshest frame in a 1-slot buffer filled by a background reader thread
+frame_grabber = FrameGrabber(cam)
+frame_grabber.start()
 
+# Shared pool for the independent per-turn inputs (camera frame, robot state, command embedding)
+executor = ThreadPoolExecutor(max_workers=4)
 
-def get_frame_data():
-    ret, frame = cam.read()
-    if not ret:
+# Repeated/paraphrased commands in an unchanged scene reuse the earlier response
+response_cache = SemanticCache()
+
+
+def get_frame_data() -> Optional[Tuple[bytes, int]]:
+    """Return the JPEG-encoded frame and a coarse hash of the scene"""
+    frame = frame_grabber.read()
+    if frame is None:
         print("Failed to capture frame.")
         return None
     resized = cv2.resize(frame, (224, 224))
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 70]
-    _, buffer = cv2.imencode('.jpg', resized, encode_param)
-    return base64.b64encode(buffer).decode('utf-8')
+    return encode_jpeg(resized, quality=70), scene_hash(resized)
 
 
 # === ACTION TRANSLATION ===
-def translate_actions(act_list: List[list]) -> List[Dict[str, Any]]:
+# Actions are (kind, command, args) tuples, translated lazily as the motion thread consumes them
+Action = Tuple[str, str, list]
+
+
+# Indexed by the model's numeric command id
+COMMAND_NAMES = (
+    'move_forward',
+    'move_backward',
+    'move_up',
+    'move_down',
+    'move_left',
+    'move_right',
+    'move_servo',
+    'wait',
+)
+
+
+def translate_actions(act_list: List[list]) -> Iterator[Action]:
     if not act_list:
-        return []
-
-    command_map = {
-        0: 'move_forward',
-        1: 'move_backward',
-        2: 'move_up',
-        3: 'move_down',
-        4: 'move_left',
-        5: 'move_right',
-        6: 'move_servo',
-        7: 'wait',
-    }
-
-    translated_list = []
+        return
+
     for action in act_list:
         if not isinstance(action, list) or len(action) < 1:
             print(f"Invalid action format: {action}")
             continue
 
-        cmd_id = action[0]
-        if cmd_id in command_map:
-            translated_list.append({
-                'type': 'motor',
-                'command': command_map[cmd_id],
-                'args': action[1:]
-            })
-        elif cmd_id == 7:
-            translated_list.append({
-                'type': 'wait',
-                'duration': action[1] if len(action) > 1 and isinstance(action[1], (int, float)) else 1.0
-            })
+        cmd_id = command_id(action[0], len(COMMAND_NAMES))
+        if cmd_id is None:
+            print(f"Unknown command ID: {action[0]}")
+            continue
+
+        name = COMMAND_NAMES[cmd_id]
+        if name == 'wait':
+            duration = action[1] if len(action) > 1 and isinstance(action[1], (int, float)) else 1.0
+            yield 'wait', name, [duration]
         else:
-            print(f"Unknown command ID: {cmd_id}")
-    return translated_list
+            yield 'motor', name, action[1:]
 
 
 # === MOTION EXECUTION SYSTEM ===
-def execute_motion_sequence(actions: List[Dict[str, Any]]) -> bool:
-    print(f"Executing {len(actions)} actions...")
-    for i, action in enumerate(actions):
-        print(f"Action {i + 1}: {action.get('type', 'unknown')}")
-
-        if action.get('type') == 'motor':
-            command = action.get('command')
-            args = action.get('args', [])
-            if command == 'move_up' and args:
-                servo_controller.move_up(args[0])
-            elif command == 'move_down' and args:
-                servo_controller.move_down(args[0])
-            elif command == 'move_forward' and args:
-                servo_controller.move_forward(args[0])
-            elif command == 'move_backward' and args:
-                servo_controller.move_backward(args[0])
-            elif command == 'move_left' and args:
-                servo_controller.move_left(args[0])
-            elif command == 'move_right' and args:
-                servo_controller.move_right(args[0])
-            elif command == 'move_servo' and len(args) >= 2:
-                servo_controller.move_servo(args[0], args[1])
-            elif command == 'hold_position' and args:
-                servo_controller.hold_position(args[0])
+# Motor command -> (handler, number of positional args it takes)
+MOTOR_HANDLERS = {
+    'move_up': (servo_controller.move_up, 1),
+    'move_down': (servo_controller.move_down, 1),
+    'move_forward': (servo_controller.move_forward, 1),
+    'move_backward': (servo_controller.move_backward, 1),
+    'move_left': (servo_controller.move_left, 1),
+    'move_right': (servo_controller.move_right, 1),
+    'move_servo': (servo_controller.move_servo, 2),
+    'hold_position': (servo_controller.hold_position, 1),
+}
+
+
+def execute_motion_sequence(actions: Iterable[Action]) -> bool:
+    print("Executing actions...")
+    for i, (kind, command, args) in enumerate(actions):
+        print(f"Action {i + 1}: {kind}")
+
+        if kind == 'motor':
+            handler, arg_count = MOTOR_HANDLERS.get(command, (None, 0))
+            if handler and len(args) >= arg_count:
+                handler(*args[:arg_count])
             else:
                 print(f"Unknown motor command: {command}")
 
-        elif action.get('type') == 'wait':
-            duration = action.get('duration', 1.0)
-            time.sleep(duration)
-
-        elif action.get('type') == 'vision_check':
-            print(f"Vision check: {action.get('target', 'general')}")
-
-        time.sleep(0.1)
+        elif kind == 'wait':
+            time.sleep(args[0])
     return True
 
 
-# === JSON PARSING (ADAPTED FOR NEW KEYS & ROBUSTNESS) ===
-def parse_ai_response(response_text: str) -> Optional[Dict[str, Any]]:
-    try:
-        # Find the first opening brace '{'
-        start_idx = response_text.find('{')
-        if start_idx == -1:
-            print("No JSON object found in the response.")
-            return None
-
-        # Find the matching closing brace '}' by counting
-        brace_count = 0
-        end_idx = -1
-        for i in range(start_idx, len(response_text)):
-            if response_text[i] == '{':
-                brace_count += 1
-            elif response_text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i + 1
-                    break
-
-        if end_idx == -1:
-            print("Mismatched braces or incomplete JSON object.")
-            return None
-
-        # Extract the JSON string from the found start and end points
-        json_str = response_text[start_idx:end_idx]
-
-        # Now, attempt to parse the extracted string
-        return json.loads(json_str)
-
-    except json.JSONDecodeError as e:
-        print(f"JSON parse error: {e}")
-        return None
-    except Exception as e:
-        print(f"Response parsing error: {e}")
-        return None
-
-
 def schedule_followup(followup_prompt: str, delay: float = 3.0):
     global pending_followup, followup_timer
 
@@ -195,8 +164,7 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
         global pending_followup
         if pending_followup:
             print(f"Follow-up: {pending_followup}")
-            engine.say(pending_followup)
-            engine.runAndWait()
+            speech.say(pending_followup)
             pending_followup = None
 
     if followup_timer:
@@ -207,61 +175,100 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
     followup_timer.start()
 
 
-# === ENHANCED GEMINI REQUEST FUNCTION ===
-def get_response(user_input: str) -> str:
+def record_turn(user_turn: Dict[str, Any], reply: str):
+    """Append a finished exchange to the history, keeping only the most recent messages"""
     global conversation_history
+    history = conversation_history + [user_turn, {"role": "model", "parts": [{"text": reply}]}]
+    if len(history) > MAX_HISTORY_MESSAGES:
+        # Trim in one big step rather than sliding every turn: an unchanged prefix of
+        # system prompt + history is what lets Gemini's implicit context cache hit
+        history = history[-(MAX_HISTORY_MESSAGES // 2):]
+    conversation_history = history
+
 
-    frame_data = get_frame_data()
-    if not frame_data:
+def handle_structured_response(structured_response: Dict[str, Any], fallback_reply: str) -> str:
+    """Start the response's motions and follow-up; returns its voice response"""
+    if structured_response.get('act'):
+        actions = translate_actions(structured_response['act'])
+        threading.Thread(target=execute_motion_sequence, args=(actions,)).start()
+
+    if structured_response.get('fu') and structured_response.get('fp'):
+        schedule_followup(structured_response.get('fp'), 3.0)
+
+    return structured_response.get('vr', fallback_reply)
+
+
+# === ENHANCED GEMINI REQUEST FUNCTION ===
+def get_response(user_input: str) -> str:
+    """
+    Stream the Gemini reply, speaking the first sentence of the voice response as soon
+    as it arrives. Returns the part of the voice response that still needs to be spoken.
+    """
+    # Capture/encode the frame, read the robot state and embed the command concurrently
+    frame_future = executor.submit(get_frame_data)
+    state_future = executor.submit(servo_controller.get_current_state)
+    key_future = executor.submit(response_cache.embed, user_input)
+    captured = frame_future.result()
+    robot_state = state_future.result()
+    cache_key = key_future.result()
+    if not captured:
         return "Camera input failed."
+    frame_data, scene = captured
 
-    robot_state = servo_controller.get_current_state()
     state_info = f"Current robot state: elevation_servo_pos={robot_state['elevation_servo_pos']}, translation_servo_pos={robot_state['translation_servo_pos']}, rotation_stepper_deg={robot_state['rotation_stepper_deg']}"
 
+    cached_response = response_cache.lookup(cache_key, scene, robot_state)
+    if cached_response:
+        print("Semantic cache hit, skipping Gemini")
+        voice_response = handle_structured_response(cached_response, "")
+        record_turn({"role": "user", "parts": [{"text": f"User command: {user_input}\n{state_info}"}]}, voice_response)
+        return voice_response
+
     vision_parts = [
         {"text": f"User command: {user_input}"},
         {"text": state_info},
         {"text": "Here is the current visual scene."},
-        {"inline_data": {
-            "mime_type": "image/jpeg",
-            "data": frame_data
-        }}
+        Part.from_bytes(data=frame_data, mime_type="image/jpeg")
     ]
 
-    conversation_history.append({"role": "user", "parts": vision_parts})
+    # Send a snapshot; the shared history is only extended once the turn completes
+    contents = conversation_history + [{"role": "user", "parts": vision_parts}]
 
-    response = client.models.generate_content(
+    stream = client.models.generate_content_stream(
         model="gemini-3-flash-preview",
-        contents=conversation_history,
-        config=GenerateContentConfig(
-            system_instruction=system_prompt,
-            temperature=0.8,
-            top_p=0.9,
-            top_k=40,
-            max_output_tokens=8192,
-        )
+        contents=contents,
+        config=generation_config
     )
 
-    gemini_reply = response.text
+    chunks = []
+    spoken_prefix = None
+    for chunk in stream:
+        if chunk.text:
+            chunks.append(chunk.text)
+        if spoken_prefix is None:
+            spoken_prefix = extract_first_sentence("".join(chunks))
+            if spoken_prefix:
+                speech.say(spoken_prefix)
+
+    gemini_reply = "".join(chunks)
     print("Gemini:", gemini_reply)
 
+    # Only the current turn needs the image; keep a text-only record of it for later turns
+    user_turn = {"role": "user", "parts": [{"text": f"User command: {user_input}\n{state_info}"}]}
+
     structured_response = parse_ai_response(gemini_reply)
 
     if structured_response:
         print("Parsed structured response successfully")
+        response_cache.store(cache_key, scene, robot_state, structured_response)
 
-        actions = translate_actions(structured_response.get('act', []))
-        if actions:
-            threading.Thread(target=execute_motion_sequence, args=(actions,)).start()
-
-        if structured_response.get('fu') and structured_response.get('fp'):
-            schedule_followup(structured_response.get('fp'), 3.0)
-
-        voice_response = structured_response.get('vr', gemini_reply)
-        conversation_history.append({"role": "model", "parts": [{"text": voice_response}]})
+        voice_response = handle_structured_response(structured_response, gemini_reply)
+        record_turn(user_turn, voice_response)
+        if spoken_prefix and voice_response.startswith(spoken_prefix):
+            return voice_response[len(spoken_prefix):].strip()
         return voice_response
     else:
-        conversation_history.append({"role": "model", "parts": [{"text": gemini_reply}]})
+        record_turn(user_turn, gemini_reply)
         return gemini_reply
 
 
@@ -281,16 +288,15 @@ while True:
             pending_followup = None
 
         reply = get_response(user_input)
-        engine.setProperty('rate', 200)
-        engine.setProperty('volume', volume)
-        engine.setProperty('voice', voices[0].id)
-        engine.say(reply)
-        engine.runAndWait()
+        speech.say(reply)
 
     except Exception as e:
         print(f"Unexpected error: {e}")
 
 # Cleanup
+speech.stop()
+executor.shutdown(wait=False)
+frame_grabber.stop()
 cam.release()
 cv2.destroyAllWindows()
 servo_controller.close()
\ No newline at end of file
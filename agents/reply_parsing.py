@@ -0,0 +1,79 @@
+"""
+Helpers for the structured JSON replies the agents get back from their models.
+Shared by the Gemini agents and the local llama.cpp/Ollama experiments.
+"""
+import json
+import re
+from typing import Any, Dict, Optional
+
+import orjson
+
+_JSON_DECODER = json.JSONDecoder()
+_SENTENCE_END_RE = re.compile(r'[.!?](?=\s)')
+# field name -> pattern matching its (possibly still incomplete) string value
+_FIELD_PREFIX_RES: Dict[str, re.Pattern] = {}
+
+
+def _field_prefix_re(field: str) -> re.Pattern:
+    if field not in _FIELD_PREFIX_RES:
+        _FIELD_PREFIX_RES[field] = re.compile(rf'"{re.escape(field)}"\s*:\s*"((?:[^"\\]|\\.)*)(")?')
+    return _FIELD_PREFIX_RES[field]
+
+
+def extract_first_sentence(partial_reply: str, field: str = "vr") -> Optional[str]:
+    """Return the first complete sentence of the given string field once it has streamed in, else None"""
+    match = _field_prefix_re(field).search(partial_reply)
+    if not match:
+        return None
+    raw = match.group(1)
+    end = _SENTENCE_END_RE.search(raw)
+    if end:
+        raw = raw[:end.end()]
+    elif not match.group(2):
+        # Neither a sentence boundary nor the closing quote has arrived yet
+        return None
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_ai_response(response_text: str) -> Optional[Dict[str, Any]]:
+    """Return the first JSON object in a model reply (code fences and trailing text are ignored), or None"""
+    try:
+        start_idx = response_text.find('{')
+        if start_idx == -1:
+            print("No JSON object found in the response.")
+            return None
+
+        # Fast path: the reply is just the object (maybe wrapped in a code fence)
+        end_idx = response_text.rfind('}') + 1
+        try:
+            return orjson.loads(response_text[start_idx:end_idx])
+        except orjson.JSONDecodeError:
+            pass
+
+        # raw_decode parses one object starting at start_idx and ignores any trailing text
+        parsed, _ = _JSON_DECODER.raw_decode(response_text, start_idx)
+        return parsed
+
+    except json.JSONDecodeError as e:
+        print(f"JSON parse error: {e}")
+        return None
+    except Exception as e:
+        print(f"Response parsing error: {e}")
+        return None
+
+
+def command_id(value: Any, count: int) -> Optional[int]:
+    """
+    Index of a command id in a table of `count` commands, or None if it isn't one.
+    Integral floats (4.0) are accepted since JSON grammars allow them; bools are not.
+    """
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float):
+        if not value.is_integer():
+            return None
+        value = int(value)
+    return value if 0 <= value < count else None
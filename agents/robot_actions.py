@@ -2,10 +2,23 @@
 Robot action translation and execution
 Separated to avoid circular imports
 """
+import queue
+import threading
 import time
 from typing import List, Dict, Any
 from agents.ServoController import ServoController
 
+# Command id -> (action type, motor command); built once instead of per call
+_ACTION_TABLE = {
+    0: ('motor', 'set_translation'),
+    1: ('motor', 'set_elevation'),
+    2: ('motor', 'move_left'),
+    3: ('motor', 'move_right'),
+    4: ('motor', 'move_servo'),
+    5: ('wait', None),
+}
+
+
 def translate_actions(act_list: List[list], servo_controller: ServoController = None) -> List[Dict[str, Any]]:
     """
     Translate numeric action lists to structured action dictionaries
@@ -21,35 +34,26 @@ def translate_actions(act_list: List[list], servo_controller: ServoController =
     if not act_list:
         return []
 
-    command_map = {
-        0: 'set_translation',
-        1: 'set_elevation',
-        2: 'move_left',
-        3: 'move_right',
-        4: 'move_servo',
-        5: 'wait',
-    }
-
     translated_list = []
     for action in act_list:
         if not isinstance(action, list) or len(action) < 1:
             print(f"Invalid action format: {action}")
             continue
 
-        cmd_id = action[0]
-        if cmd_id in command_map and cmd_id != 5:
+        kind, command = _ACTION_TABLE.get(action[0], (None, None))
+        if kind == 'motor':
             translated_list.append({
                 'type': 'motor',
-                'command': command_map[cmd_id],
+                'command': command,
                 'args': action[1:]
             })
-        elif cmd_id == 5:
+        elif kind == 'wait':
             translated_list.append({
                 'type': 'wait',
                 'duration': action[1] if len(action) > 1 and isinstance(action[1], (int, float)) else 1.0
             })
         else:
-            print(f"Unknown command ID: {cmd_id}")
+            print(f"Unknown command ID: {action[0]}")
     return translated_list
 
 
@@ -89,3 +93,30 @@ def execute_motion_sequence(actions: List[Dict[str, Any]], servo_controller: Ser
 
     return True
 
+
+# One long-lived thread runs queued sequences in order, so replies that arrive while the
+# robot is still moving wait their turn instead of racing it on the servos
+_motion_queue = queue.Queue()
+_motion_worker = None
+_motion_worker_lock = threading.Lock()
+
+
+def _motion_loop():
+    while True:
+        actions, servo_controller = _motion_queue.get()
+        try:
+            execute_motion_sequence(actions, servo_controller)
+        except Exception as e:
+            print(f"Motion error: {e}")
+        finally:
+            _motion_queue.task_done()
+
+
+def queue_motion_sequence(actions: List[Dict[str, Any]], servo_controller: ServoController):
+    """Run a sequence on the shared motion thread after any already queued; returns immediately"""
+    global _motion_worker
+    with _motion_worker_lock:
+        if _motion_worker is None:
+            _motion_worker = threading.Thread(target=_motion_loop, daemon=True)
+            _motion_worker.start()
+    _motion_queue.put((actions, servo_controller))
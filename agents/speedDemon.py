@@ -11,7 +11,7 @@ import base64
 import json
 import time
 import os
-import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
@@ -32,6 +32,8 @@ load_dotenv(override=True)
 
 # === IMPORT SERVO CONTROLLER ===
 from agents.ServoController import ServoController
+from agents.reply_parsing import extract_first_sentence
+from agents.FrameGrabber import FrameGrabber, encode_jpeg, open_camera, scene_hash
 
 # === IMPORT WAKE WORD & TRANSCRIPTION ===
 from wakeWord.wake import listen_for_wake_word
@@ -42,19 +44,12 @@ from tasks.command_parser import parse_scheduling_request
 from tasks.scheduled_actions_v2 import create_scheduled_action
 
 # === IMPORT ROBOT ACTIONS ===
-from agents.robot_actions import translate_actions, execute_motion_sequence
+from agents.robot_actions import translate_actions, queue_motion_sequence
 
 
 # === GEMINI CLIENT SETUP ===
 client = genai.Client(api_key=os.getenv("API_KEY"))
 
-generation_config = GenerateContentConfig(
-    temperature=0.8,
-    top_p=0.9,
-    top_k=40,
-    max_output_tokens=8192,
-)
-
 # === SYSTEM PROMPT ===
 try:
     # Use absolute path relative to project root
@@ -67,6 +62,17 @@ except FileNotFoundError:
 
 print("System prompt loaded successfully" if system_prompt else "Using fallback system prompt")
 
+# Built once; every turn uses the same system prompt and structured-output schema
+generation_config = GenerateContentConfig(
+    system_instruction=system_prompt,
+    temperature=0.8,
+    top_p=0.9,
+    top_k=40,
+    max_output_tokens=8192,
+    response_mime_type="application/json",
+    response_schema=RobotResponse,
+)
+
 # === ROBOT CONTROLLER INITIALIZATION ===
 servo_controller = ServoController()
 servo_controller.set_elevation(1)  # Start at middle elevation
@@ -86,7 +92,7 @@ else:
 # === TICKTICK BACKGROUND POLLER ===
 task_poller = TickTickPoller(
     ticktick_agent=ticktick_agent,
-    voice_fn=voice.stream_audio,
+    voice_fn=voice.say,  # Reminders share the playback queue so they never overlap a reply
     servo_controller=servo_controller,
     check_interval_minutes=30,
 )
@@ -95,30 +101,51 @@ if ticktick_agent.is_running():
 
 # === INITIAL STATE ===
 conversation_history = []
+# Text-only mirror of conversation_history (no camera frames) handed to the task/search
+# validators, which serialize it into their prompts every turn
+context_history = []
 listening = True
 exit_words = ["exit", "stop", "quit", "bye", "goodbye"]
 
 # === CAMERA SETUP ===
-cam = cv2.VideoCapture(0)
+cam = open_camera(0)
+
+# Keep the freshest frame in a 1-slot buffer filled by a background reader thread
+frame_grabber = FrameGrabber(cam)
+frame_grabber.start()
+
+# Frame encoding runs here so it overlaps with the task/search checks
+frame_executor = ThreadPoolExecutor(max_workers=1)
+
+# The TickTick check runs here while search validation runs on the main thread
+validation_executor = ThreadPoolExecutor(max_workers=1)
+
+
+_last_frame = None  # (scene hash, base64 JPEG) of the last encoded frame
 
 
 def get_frame_data():
-    ret, frame = cam.read()
-    if not ret:
+    """Base64 JPEG of the current frame, reusing the last one if the scene hash is unchanged"""
+    global _last_frame
+    frame = frame_grabber.read(copy=False)
+    if frame is None:
         print("Failed to capture frame.")
         return None
     resized = cv2.resize(frame, (224, 224))
-    _, buffer = cv2.imencode('.jpg', resized)
-    return base64.b64encode(buffer).decode('utf-8')
+    frame_hash = scene_hash(resized)
+    if _last_frame is None or _last_frame[0] != frame_hash:
+        _last_frame = (frame_hash, base64.b64encode(encode_jpeg(resized, quality=70)).decode('utf-8'))
+    return _last_frame[1]
 
 
 # Motion execution functions now imported from robot_actions module
 
 # === ENHANCED GEMINI REQUEST FUNCTION ===
-def get_response(user_input: str, search_context: Optional[str] = None, task_context: Optional[str] = None) -> str:
+def get_response(user_input: str, search_context: Optional[str] = None, task_context: Optional[str] = None,
+                 frame_future: Optional[Future] = None) -> str:
     global conversation_history
 
-    frame_data = get_frame_data()
+    frame_data = frame_future.result() if frame_future else get_frame_data()
     if not frame_data:
         return "Camera input failed."
 
@@ -148,23 +175,26 @@ def get_response(user_input: str, search_context: Optional[str] = None, task_con
     ])
 
     conversation_history.append({"role": "user", "parts": vision_parts})
+    context_history.append({"role": "user", "parts": [{"text": f"User command: {user_input}"}]})
 
-    response = client.models.generate_content(
+    # Stream the structured reply and start speaking its first sentence as soon as it arrives
+    stream = client.models.generate_content_stream(
         model="gemini-3-flash-preview",
         contents=conversation_history,
-        config=GenerateContentConfig(
-            system_instruction=system_prompt,
-            temperature=0.8,
-            top_p=0.9,
-            top_k=40,
-            max_output_tokens=8192,
-            response_mime_type="application/json",
-            response_schema=RobotResponse,
-        )
+        config=generation_config
     )
 
-    # Use structured output directly - no parsing needed!
-    robot_response: RobotResponse = response.parsed
+    chunks = []
+    spoken_prefix = None
+    for chunk in stream:
+        if chunk.text:
+            chunks.append(chunk.text)
+        if spoken_prefix is None:
+            spoken_prefix = extract_first_sentence("".join(chunks))
+            if spoken_prefix:
+                voice.say(spoken_prefix)
+
+    robot_response = RobotResponse.model_validate_json("".join(chunks))
     
     print("Gemini:", robot_response.vr)
     print("Actions:", robot_response.act)
@@ -173,13 +203,17 @@ def get_response(user_input: str, search_context: Optional[str] = None, task_con
     if robot_response.act and isinstance(robot_response.act, list):
         translated = translate_actions(robot_response.act)
         if translated:
-            threading.Thread(target=execute_motion_sequence, args=(translated, servo_controller)).start()
+            queue_motion_sequence(translated, servo_controller)
 
     # fu = robot_response.fu
     # fp = robot_response.fp
     # Follow-up handling can be added here if needed using fu/fp
 
     conversation_history.append({"role": "model", "parts": [{"text": robot_response.vr}]})
+    context_history.append({"role": "model", "parts": [{"text": robot_response.vr}]})
+    # Only the part of the voice response that hasn't been queued yet
+    if spoken_prefix and robot_response.vr.startswith(spoken_prefix):
+        return robot_response.vr[len(spoken_prefix):].strip()
     return robot_response.vr
 
 
@@ -227,7 +261,7 @@ while listening:
                 )
                 
                 # Confirm to user
-                voice.stream_audio(schedule_request.confirmation_message)
+                voice.say(schedule_request.confirmation_message)
                 print(f"✅ Scheduled action ID: {action.id}")
 
                 # Also add to TickTick for persistent tracking
@@ -244,29 +278,37 @@ while listening:
                 continue  # Don't process as normal command
 
             # === NORMAL INTERACTION ===
+            # Start encoding the current frame while the task/search checks run
+            frame_future = frame_executor.submit(get_frame_data)
+
             # Get recent conversation context (pass list, not JSON string)
             recent_context = None
-            if len(conversation_history) > 0:
+            if len(context_history) > 0:
                 # Pass last 4 items (2 question-answer pairs) as a list
-                recent_context = conversation_history[-4:] if len(conversation_history) >= 4 else conversation_history
+                recent_context = context_history[-4:]
 
             # === CHECK IF THIS IS A TASK MANAGEMENT REQUEST ===
-            need_task, task_result = ticktick_agent.validate_task_need(
-                transcript, conversation_context=recent_context
+            # Independent of the search check, so both sets of API calls run concurrently
+            task_future = validation_executor.submit(
+                ticktick_agent.validate_task_need, transcript, conversation_context=recent_context
             )
 
             # === CHECK IF SEARCH IS NEEDED ===
             need_search, search_result = search.validate_search_need(
                 transcript, conversation_context=recent_context
             )
+            need_task, task_result = task_future.result()
 
             # Build response with any available context
             reply = get_response(
                 transcript,
                 search_context=search_result if need_search else None,
                 task_context=task_result if need_task else None,
+                frame_future=frame_future,
             )
-            voice.stream_audio(reply)
+            voice.say(reply)
+            # Finish speaking before listening again so the mic doesn't hear the robot
+            voice.wait_until_done()
         else:
             print("No transcript received.")
 
@@ -281,6 +323,9 @@ while listening:
         print(f"Unexpected error: {e}")
 
 # Cleanup
+frame_grabber.stop()
+frame_executor.shutdown(wait=False)
+validation_executor.shutdown(wait=False)
 cam.release()
 cv2.destroyAllWindows()
 task_poller.stop()
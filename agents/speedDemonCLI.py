@@ -6,6 +6,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 import google.genai as genai
 from google.genai.types import GenerateContentConfig
 import json
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 import search.search as search
@@ -26,13 +27,6 @@ load_dotenv(override=True)
 # === GEMINI CLIENT SETUP ===
 client = genai.Client(api_key=os.getenv("API_KEY"))
 
-generation_config = GenerateContentConfig(
-    temperature=0.8,
-    top_p=0.9,
-    top_k=40,
-    max_output_tokens=8192,
-)
-
 # === SYSTEM PROMPT ===
 try:
     # Use absolute path relative to project root
@@ -45,6 +39,17 @@ except FileNotFoundError:
 
 print("System prompt loaded successfully" if system_prompt else "Using fallback system prompt")
 
+# Built once; every turn uses the same system prompt and structured-output schema
+generation_config = GenerateContentConfig(
+    system_instruction=system_prompt,
+    temperature=0.8,
+    top_p=0.9,
+    top_k=40,
+    max_output_tokens=8192,
+    response_mime_type="application/json",
+    response_schema=RobotResponse,
+)
+
 # === TICKTICK SUB-AGENT ===
 ticktick_agent = TickTickAgent()
 if ticktick_agent.start():
@@ -65,6 +70,9 @@ if ticktick_agent.is_running():
 conversation_history = []
 exit_words = ["exit", "stop", "quit", "bye", "goodbye"]
 
+# The TickTick check runs here while search validation runs on the main thread
+validation_executor = ThreadPoolExecutor(max_workers=1)
+
 
 def get_response(user_input: str, search_context: Optional[str] = None, task_context: Optional[str] = None) -> str:
     """Get response from Gemini without camera input"""
@@ -88,15 +96,7 @@ def get_response(user_input: str, search_context: Optional[str] = None, task_con
     response = client.models.generate_content(
         model="gemini-3-flash-preview",
         contents=conversation_history,
-        config=GenerateContentConfig(
-            system_instruction=system_prompt,
-            temperature=0.8,
-            top_p=0.9,
-            top_k=40,
-            max_output_tokens=8192,
-            response_mime_type="application/json",
-            response_schema=RobotResponse,
-        )
+        config=generation_config
     )
 
     # Use structured output directly - no parsing needed!
@@ -141,16 +141,18 @@ while True:
             recent_context = conversation_history[-4:] if len(conversation_history) >= 4 else conversation_history
 
         # === CHECK IF THIS IS A TASK MANAGEMENT REQUEST ===
-        need_task, task_result = ticktick_agent.validate_task_need(
-            user_input, conversation_context=recent_context
+        # Independent of the search check, so both sets of API calls run concurrently
+        task_future = validation_executor.submit(
+            ticktick_agent.validate_task_need, user_input, conversation_context=recent_context
         )
-        if need_task:
-            print("[Task handled by TickTick sub-agent]")
 
         # === CHECK IF SEARCH IS NEEDED ===
         need_search, search_result = search.validate_search_need(
             user_input, conversation_context=recent_context
         )
+        need_task, task_result = task_future.result()
+        if need_task:
+            print("[Task handled by TickTick sub-agent]")
         if need_search:
             print(f"[Search needed. Context retrieved: {len(search_result)} chars]")
 
@@ -179,3 +181,4 @@ while True:
 
 task_poller.stop()
 ticktick_agent.stop()
+validation_executor.shutdown(wait=False)
@@ -1,6 +1,8 @@
 from elevenlabs.client import ElevenLabs
 from elevenlabs import stream
 import os
+import queue
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -22,3 +24,32 @@ def stream_audio(text):
 
     stream(audio_stream)
 
+
+# Queued playback: say() returns immediately and texts are spoken in order on one thread,
+# so a reply's first sentence can start playing while the rest is still being generated
+_speech_queue = queue.Queue()
+
+
+def _speech_loop():
+    while True:
+        text = _speech_queue.get()
+        try:
+            stream_audio(text)
+        except Exception as e:
+            print(f"TTS error: {e}")
+        finally:
+            _speech_queue.task_done()
+
+
+threading.Thread(target=_speech_loop, daemon=True).start()
+
+
+def say(text):
+    """Queue text to be spoken after anything already queued; returns immediately"""
+    if text:
+        _speech_queue.put(text)
+
+
+def wait_until_done():
+    """Block until everything queued so far has been spoken"""
+    _speech_queue.join()
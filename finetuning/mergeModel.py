@@ -25,4 +25,7 @@ model.save_pretrained(MERGED_MODEL_PATH)
 tokenizer = AutoTokenizer.from_pretrained(ADAPTER_PATH)
 tokenizer.save_pretrained(MERGED_MODEL_PATH)
 
-print("? Merged model saved successfully!")
\ No newline at end of file
+print("? Merged model saved successfully!")
+print("Next, for llama.cpp (pices.py):")
+print(f"  python convert_hf_to_gguf.py {MERGED_MODEL_PATH} --outfile merged.gguf")
+print("  llama-quantize merged.gguf meLlamo-expert-robot-v1-Q4_K_M.gguf Q4_K_M")
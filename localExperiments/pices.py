@@ -1,18 +1,23 @@
 import speech_recognition as sr
-import pyttsx3
+import os
 import base64
-import json
+import orjson
 import time
 import threading
 import cv2
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
 
 # === GGUF Model Imports ===
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaGrammar, LlamaRAMCache
+from llama_cpp.llama_chat_format import Llava15ChatHandler
 
 # === IMPORT SERVO CONTROLLER ===
 from agents.ServoController import ServoController
+from agents.reply_parsing import command_id, extract_first_sentence, parse_ai_response
+from agents.SpeechWorker import SpeechWorker
+from agents.FrameGrabber import FrameGrabber, encode_jpeg, open_camera, scene_hash, hash_distance
 
 # ==============================================================================
 # === 1. LOAD MODELS (GGUF Format for Mac Performance)
@@ -22,38 +27,61 @@ from agents.ServoController import ServoController
 # IMPORTANT: This must be the path to the LoRA adapter AFTER converting it to GGUF format.
 ADAPTER_GGUF_PATH = "./bot.gguf"
 
-print("Loading GGUF models for Mac (Metal)...")
+# --- Path to the merged + quantized model (preferred when present) ---
+# Produced offline: finetuning/mergeModel.py, then llama.cpp's convert_hf_to_gguf.py and
+# `llama-quantize merged.gguf <this file> Q4_K_M`. With the LoRA baked into the weights,
+# decoding no longer pays for the extra adapter matmuls on every layer.
+MERGED_GGUF_PATH = "./meLlamo-expert-robot-v1-Q4_K_M.gguf"
 
-# === Main Language Model (Mistral-7B-Instruct GGUF) ===
-# This model will handle commands and generate robot actions.
-# NOTE: Update the repo_id and filename to match the GGUF file you download.
-main_model = Llama.from_pretrained(
-    repo_id="MaziyarPanahi/Mistral-7B-Instruct-v0.3-GGUF",
-    filename="Mistral-7B-Instruct-v0.3.Q4_K_M.gguf",
-    lora_path=ADAPTER_GGUF_PATH,  # Apply the LoRA adapter at load time
+MAIN_MODEL_OPTIONS = dict(
     n_gpu_layers=-1,  # Offload all possible layers to GPU
     n_ctx=4096,  # Context window size
+    n_batch=2048,  # Prefill the prompt in large batches
+    n_threads=os.cpu_count(),
+    use_mmap=True,
+    use_mlock=True,  # Pin the weights in RAM so they aren't paged out between turns
     verbose=False
 )
 
-# AFTER: Loads from a local file
-# main_model = Llama(
-#     model_path="/Users/PV/PycharmProjects/meLlamo/bot.gguf", # <-- IMPORTANT: Update this path
-#     lora_path=ADAPTER_GGUF_PATH,
-#     n_gpu_layers=-1,
-#     n_ctx=4096,
-#     verbose=False
-# )
+print("Loading GGUF models for Mac (Metal)...")
+
+# === Main Language Model (Mistral-7B-Instruct GGUF) ===
+# This model will handle commands and generate robot actions.
+if os.path.exists(MERGED_GGUF_PATH):
+    main_model = Llama(model_path=MERGED_GGUF_PATH, **MAIN_MODEL_OPTIONS)
+else:
+    # NOTE: Update the repo_id and filename to match the GGUF file you download.
+    main_model = Llama.from_pretrained(
+        repo_id="MaziyarPanahi/Mistral-7B-Instruct-v0.3-GGUF",
+        filename="Mistral-7B-Instruct-v0.3.Q4_K_M.gguf",
+        lora_path=ADAPTER_GGUF_PATH,  # Apply the LoRA adapter at load time
+        **MAIN_MODEL_OPTIONS
+    )
 
 # === VLM for Scene Description (SmolVLM) ===
-# This model remains the same.
+# The multimodal projector turns the camera frame into image embeddings for the model;
+# without it the prompt has no image and the description is made up.
+vision_chat_handler = Llava15ChatHandler.from_pretrained(
+    repo_id="ggml-org/SmolVLM-500M-Instruct-GGUF",
+    filename="mmproj-SmolVLM-500M-Instruct-Q8_0.gguf",
+    verbose=False
+)
 vision_model = Llama.from_pretrained(
     repo_id="ggml-org/SmolVLM-500M-Instruct-GGUF",
     filename="SmolVLM-500M-Instruct-Q8_0.gguf",
+    chat_handler=vision_chat_handler,
+    n_ctx=2048,  # Room for the image embeddings plus the reply
     n_gpu_layers=-1,
+    n_threads=os.cpu_count(),
+    use_mmap=True,
+    use_mlock=True,
     verbose=False
 )
 
+# Keep evaluated prompt states around so static prompt prefixes aren't re-evaluated every turn
+main_model.set_cache(LlamaRAMCache())
+vision_model.set_cache(LlamaRAMCache())
+
 print("? All models loaded successfully using llama-cpp-python!")
 
 # ==============================================================================
@@ -61,10 +89,12 @@ print("? All models loaded successfully using llama-cpp-python!")
 # ==============================================================================
 
 # === Voice Setup ===
-engine = pyttsx3.init()
-voices = engine.getProperty('voices')
-rate = engine.getProperty('rate')
-volume = engine.getProperty('volume')
+# Streaming Piper voice, used instead of pyttsx3 when the model file is present
+PIPER_VOICE_PATH = os.getenv("PIPER_VOICE_PATH", "en_US-amy-medium.onnx")
+# Speech runs on its own thread so the prompt comes back while a reply is still playing;
+# the fixed "Ready" acknowledgement is pre-rendered once
+speech = SpeechWorker(rate=200, cached_phrases=("Ready",), piper_model=PIPER_VOICE_PATH)
+speech.start()
 
 # === System Prompt ===
 try:
@@ -76,6 +106,32 @@ except FileNotFoundError:
     print("Error: scorpio_system_prompt.txt not found.")
     INSTRUCTION_PROMPT = "You are an expert robotic control system. Given the user's command, the current robot state, and a description of the scene, generate a JSON response with the robot's actions and speech."
 
+# Static head of every prompt; keeping it byte-identical lets llama.cpp reuse its KV cache
+PROMPT_PREFIX = f"""### Instruction:
+                {INSTRUCTION_PROMPT}
+                
+                ### Input:
+                """
+# Tokenized once; each turn only tokenizes its own input and appends it
+PREFIX_TOKENS = main_model.tokenize(PROMPT_PREFIX.encode("utf-8"))
+
+# Constrains decoding to the fine-tuned output schema (same key order as the training data),
+# so the reply always parses and no tokens are spent on prose around the object
+RESPONSE_GRAMMAR = LlamaGrammar.from_string(r'''
+root    ::= "{" ws "\"vr\":" ws string "," ws "\"fu\":" ws boolean "," ws "\"fp\":" ws string "," ws "\"act\":" ws actions ws "}"
+actions ::= "[" ws ( action ( "," ws action )* )? ws "]"
+action  ::= "[" ws number ( "," ws number )* ws "]"
+number  ::= "-"? [0-9]+ ( "." [0-9]+ )?
+boolean ::= "true" | "false"
+string  ::= "\"" ( [^"\\\x00-\x1f] | "\\" ( ["\\/bfnrt] | "u" [0-9a-fA-F]{4} ) )* "\""
+ws      ::= " "?
+''', verbose=False)
+
+# Warm up both models so the first real turn doesn't pay for page faults and kernel setup.
+# The main model is primed with the prompt prefix, which also leaves it in the KV cache.
+main_model(PREFIX_TOKENS, max_tokens=1)
+vision_model("USER: hi\nASSISTANT:", max_tokens=1)
+
 # === Robot Controller & State ===
 servo_controller = ServoController()
 listening = True
@@ -85,30 +141,43 @@ pending_followup = None
 followup_timer = None
 sending_to_model = False
 
+# Runs the SmolVLM scene description while the rest of the prompt is assembled
+model_executor = ThreadPoolExecutor(max_workers=1)
+
 # === Camera Setup ===
-cam = cv2.VideoCapture(0)
+# MJPG at 640x480: cheap to transfer and decode, and enough detail for the 384x384 VLM input
+cam = open_camera(0, width=640, height=480)
+
+# Latest frame is kept by a background reader so get_response never waits on the camera
+frame_grabber = FrameGrabber(cam)
+frame_grabber.start()
 
 
 # ==============================================================================
 # === 3. HELPER FUNCTIONS (Unchanged)
 # ==============================================================================
 
-def get_frame_data():
-    ret, frame = cam.read()
-    if not ret:
+def get_frame_data() -> Optional[Tuple[bytes, int]]:
+    """Return the JPEG-encoded frame and a coarse hash of the scene"""
+    frame = frame_grabber.read(copy=False)
+    if frame is None:
         print("Failed to capture frame.")
         return None
-    _, buffer = cv2.imencode('.jpg', frame)
-    return buffer.tobytes()
+    # SmolVLM downsamples internally anyway; a smaller, lower-quality JPEG is far less data to encode and embed
+    resized = cv2.resize(frame, (384, 384), interpolation=cv2.INTER_AREA)
+    return encode_jpeg(resized, quality=75), scene_hash(resized)
 
 
 def get_scene_description_from_smolvlm(image_bytes: bytes) -> str:
-    encoded_image = base64.b64encode(image_bytes).decode('utf-8')
-    prompt = f"USER: <image>\nDescribe this scene\nASSISTANT:"
+    image_url = "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("ascii")
+    messages = [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": image_url}},
+        {"type": "text", "text": "Describe this scene"},
+    ]}]
     try:
         print("Sending image to SmolVLM for scene description...")
-        output = vision_model(prompt, max_tokens=150, stop=["USER:", "\n"], temperature=0.7)
-        description = output['choices'][0]['text'].strip()
+        output = vision_model.create_chat_completion(messages=messages, max_tokens=150, stop=["\n"], temperature=0.7)
+        description = output['choices'][0]['message']['content'].strip()
         print("SmolVLM Scene Description:", description)
         return description
     except Exception as e:
@@ -116,59 +185,57 @@ def get_scene_description_from_smolvlm(image_bytes: bytes) -> str:
         return "Unable to describe the scene."
 
 
-def execute_motion_sequence(actions: List[Dict[str, Any]]) -> bool:
-    print(f"Executing {len(actions)} translated actions...")
-    for i, action in enumerate(actions):
-        cmd_type = action.get('type', 'unknown')
-        print(f"Action {i + 1}: Type={cmd_type}, Details={action}")
+# Frames whose hashes differ by at most this many bits are treated as the same scene
+SCENE_CHANGE_BITS = 4
+_last_scene = None  # (scene hash, description) of the last described frame
+
+
+def describe_scene(image_bytes: bytes, frame_hash: int) -> str:
+    """Describe the scene with SmolVLM, reusing the last description if the view hasn't changed"""
+    global _last_scene
+    if _last_scene and hash_distance(_last_scene[0], frame_hash) <= SCENE_CHANGE_BITS:
+        print("Scene unchanged, reusing the previous description.")
+        return _last_scene[1]
+    description = get_scene_description_from_smolvlm(image_bytes)
+    if description != "Unable to describe the scene.":
+        _last_scene = (frame_hash, description)
+    return description
+
+
+# Actions are (kind, command, args) tuples, translated lazily as the motion thread consumes them
+Action = Tuple[str, str, list]
+
+# Motor command -> (handler, number of positional args it takes)
+MOTOR_HANDLERS = {
+    'move_up': (servo_controller.move_up, 1),
+    'move_down': (servo_controller.move_down, 1),
+    'move_forward': (servo_controller.move_forward, 1),
+    'move_backward': (servo_controller.move_backward, 1),
+    'move_left': (servo_controller.move_left, 1),
+    'move_right': (servo_controller.move_right, 1),
+    'move_servo': (servo_controller.move_servo, 2),
+}
+
+
+def execute_motion_sequence(actions: Iterable[Action]) -> bool:
+    print("Executing translated actions...")
+    batch = []  # motor calls since the last wait, sent to the controller in one write
+    for i, (cmd_type, command, args) in enumerate(actions):
+        print(f"Action {i + 1}: Type={cmd_type}, Command={command}, Args={args}")
         if cmd_type == 'motor':
-            command = action.get('command')
-            args = action.get('args', [])
-            if command == 'move_up' and args:
-                servo_controller.move_up(args[0])
-            elif command == 'move_down' and args:
-                servo_controller.move_down(args[0])
-            elif command == 'move_forward' and args:
-                servo_controller.move_forward(args[0])
-            elif command == 'move_backward' and args:
-                servo_controller.move_backward(args[0])
-            elif command == 'move_left' and args:
-                servo_controller.move_left(args[0])
-            elif command == 'move_right' and args:
-                servo_controller.move_right(args[0])
-            elif command == 'move_servo' and len(args) >= 2:
-                servo_controller.move_servo(args[0], args[1])
-            elif command == 'wait' and args:
-                time.sleep(args[0])
+            handler, arg_count = MOTOR_HANDLERS.get(command, (None, 0))
+            if handler and len(args) >= arg_count:
+                batch.append((handler, tuple(args[:arg_count])))
             else:
                 print(f"Unknown motor command: {command}")
         elif cmd_type == 'wait':
-            time.sleep(action.get('duration', 1.0))
+            servo_controller.execute_batch(batch)
+            batch = []
+            time.sleep(args[0])
+    servo_controller.execute_batch(batch)
     return True
 
 
-def parse_ai_response(response_text: str) -> Optional[Dict[str, Any]]:
-    try:
-        json_start = response_text.find('{')
-        if json_start == -1: return None
-        brace_count = 0
-        json_end = -1
-        for i, char in enumerate(response_text[json_start:]):
-            if char == '{':
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-            if brace_count == 0:
-                json_end = json_start + i + 1
-                break
-        if json_end == -1: return None
-        json_str = response_text[json_start:json_end]
-        return json.loads(json_str)
-    except Exception as e:
-        print(f"JSON parsing error: {e}")
-        return None
-
-
 def schedule_followup(followup_prompt: str, delay: float = 3.0):
     global pending_followup, followup_timer
 
@@ -176,8 +243,7 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
         global pending_followup
         if pending_followup:
             print(f"Follow-up: {pending_followup}")
-            engine.say(pending_followup)
-            engine.runAndWait()
+            speech.say(pending_followup)
             pending_followup = None
 
     if followup_timer: followup_timer.cancel()
@@ -189,93 +255,104 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
 # ==============================================================================
 # === 4. ACTION TRANSLATOR (Unchanged)
 # ==============================================================================
-def translate_actions(act_list: List[list]) -> List[Dict[str, Any]]:
+# Indexed by the model's numeric command id
+COMMAND_NAMES = (
+    'move_forward',
+    'move_backward',
+    'move_up',
+    'move_down',
+    'move_left',
+    'move_right',
+    'move_servo',
+    'wait',
+)
+WAIT_ID = COMMAND_NAMES.index('wait')
+
+
+def translate_actions(act_list: List[list]) -> Iterator[Action]:
     if not act_list:
-        return []
-
-    command_map = {
-        0: 'move_forward',
-        1: 'move_backward',
-        2: 'move_up',
-        3: 'move_down',
-        4: 'move_left',
-        5: 'move_right',
-        6: 'move_servo',
-        7: 'wait',
-    }
-
-    translated_list = []
+        return
+
     for action in act_list:
-        cmd_id = action[0]
-        if cmd_id in command_map:
-            translated_list.append({
-                'type': 'motor',
-                'command': command_map[cmd_id],
-                'args': action[1:]
-            })
-        elif cmd_id == 7:  # Wait command
-            translated_list.append({
-                'type': 'wait',
-                'duration': action[1] if len(action) > 1 else 1.0
-            })
-    return translated_list
+        cmd_id = command_id(action[0], len(COMMAND_NAMES))
+        if cmd_id is None:
+            continue
+        if cmd_id == WAIT_ID:
+            yield 'wait', 'wait', [action[1] if len(action) > 1 else 1.0]
+        else:
+            yield 'motor', COMMAND_NAMES[cmd_id], action[1:]
 
 
 # ==============================================================================
 # === 5. MODIFIED MAIN REQUEST FUNCTION
 # ==============================================================================
 def get_response(user_input: str) -> str:
-    # 1. Get Scene and State
-    image_bytes = get_frame_data()
-    scene_description = "Camera failed."
-    if image_bytes:
-        scene_description = get_scene_description_from_smolvlm(image_bytes)
+    """
+    Stream the model reply, speaking the first sentence of "vr" as soon as it arrives.
+    Returns the part of the voice response that still needs to be spoken.
+    """
+    # 1. Get Scene and State (the VLM runs in the background while the state is read)
+    captured = get_frame_data()
+    scene_future = model_executor.submit(describe_scene, *captured) if captured else None
 
     robot_state_dict = servo_controller.get_current_state()
-    robot_state_str = json.dumps(robot_state_dict)
+    robot_state_str = orjson.dumps(robot_state_dict).decode()
+
+    scene_description = scene_future.result() if scene_future else "Camera failed."
 
     # 2. Compose the prompt in the fine-tuned format
     # This uses the standard Alpaca instruction format, which Mistral Instruct models handle well.
-    final_prompt = f"""### Instruction:
-                {INSTRUCTION_PROMPT}
-                
-                ### Input:
-                User Command: {user_input}
+    turn_prompt = f"""User Command: {user_input}
                 Current robot state: {robot_state_str}
                 Scene description: {scene_description}
                 
                 ### Response:
                 """
+    prompt_tokens = PREFIX_TOKENS + main_model.tokenize(turn_prompt.encode("utf-8"), add_bos=False)
 
-    # 3. Send to the fine-tuned model (Simplified GGUF call)
+    # 3. Stream from the fine-tuned model so speech can start before decoding finishes
     print("\n--- Sending to Fine-tuned GGUF Model ---")
 
+    chunks = []
+    spoken_prefix = None
     try:
-        output = main_model(
-            prompt=final_prompt,
+        stream = main_model(
+            prompt=prompt_tokens,
             max_tokens=256,
             stop=["###"],  # Stop generation at the next section
             temperature=0.7,
-            echo=False  # Do not repeat the prompt in the output
+            echo=False,  # Do not repeat the prompt in the output
+            grammar=RESPONSE_GRAMMAR,
+            stream=True
         )
-    except e:
+        for part in stream:
+            chunks.append(part['choices'][0]['text'])
+            if spoken_prefix is None:
+                spoken_prefix = extract_first_sentence("".join(chunks))
+                if spoken_prefix:
+                    speech.say(spoken_prefix)
+    except Exception as e:
         print(e)
+        return "Sorry, I'm having trouble thinking right now."
 
-    model_reply = output['choices'][0]['text'].strip()
+    model_reply = "".join(chunks).strip()
     print("Model Reply:", model_reply)
 
     # 4. Parse and execute (Unchanged)
     structured_response = parse_ai_response(model_reply)
     if structured_response:
         print("Parsed response successfully.")
-        actions_to_execute = translate_actions(structured_response.get('act', []))
-        if actions_to_execute:
+        if structured_response.get('act'):
+            actions_to_execute = translate_actions(structured_response['act'])
             threading.Thread(target=execute_motion_sequence, args=(actions_to_execute,)).start()
 
         if structured_response.get('fu') and structured_response.get('fp'):
             schedule_followup(structured_response.get('fp'), 3.0)
 
-        return structured_response.get('vr', "I processed the command but have nothing to say.")
+        voice_response = structured_response.get('vr', "I processed the command but have nothing to say.")
+        if spoken_prefix and voice_response.startswith(spoken_prefix):
+            return voice_response[len(spoken_prefix):].strip()
+        return voice_response
     else:
         return model_reply
 
@@ -299,8 +376,7 @@ while listening:
         if wake_word in user_input.lower():
             sending_to_model = True
             print("Wake word detected. I'm ready for your command.")
-            engine.say("Ready")
-            engine.runAndWait()
+            speech.say("Ready")
             continue
 
         if sending_to_model:
@@ -310,10 +386,7 @@ while listening:
 
             reply = get_response(user_input)
             print("Robot:", reply)
-            engine.setProperty('rate', 200)
-            engine.setProperty('volume', volume)
-            engine.say(reply)
-            engine.runAndWait()
+            speech.say(reply)
 
     except KeyboardInterrupt:
         print("\nInterrupted. Exiting.")
@@ -322,6 +395,9 @@ while listening:
         print(f"An unexpected error occurred in the main loop: {e}")
 
 # Cleanup
+speech.stop()
+model_executor.shutdown(wait=False)
+frame_grabber.stop()
 cam.release()
 cv2.destroyAllWindows()
 servo_controller.close()
\ No newline at end of file
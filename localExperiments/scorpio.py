@@ -1,38 +1,72 @@
 import speech_recognition as sr
-import pyttsx3
 import google.genai as genai
 from google.genai.types import GenerateContentConfig, SafetySetting, HarmCategory, HarmBlockThreshold
 import cv2
+import numpy as np
 import base64
-import json
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Tuple
 import ollama
 import openai
-import base64
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaRAMCache
 from dotenv import load_dotenv
 import os
 # === IMPORT SERVO CONTROLLER ===
 from agents.ServoController import ServoController
+from agents.reply_parsing import extract_first_sentence, parse_ai_response
+from agents.SpeechWorker import SpeechWorker
+from agents.FrameGrabber import FrameGrabber, scene_hash, hash_distance
 
 openai.api_base = "http://localhost:8080/v1"
 openai.api_key = "not-needed"
 
 # === ENHANCED VOICE SETUP ===
-engine = pyttsx3.init()
-voices = engine.getProperty('voices')
-rate = engine.getProperty('rate')
-volume = engine.getProperty('volume')
+# Streaming Piper voice, used instead of pyttsx3 when the model file is present
+PIPER_VOICE_PATH = os.getenv("PIPER_VOICE_PATH", "en_US-amy-medium.onnx")
+# Speech runs on its own thread so the prompt comes back while a reply is still playing
+speech = SpeechWorker(rate=200, voice_index=0, piper_model=PIPER_VOICE_PATH)
+speech.start()
 llm = Llama.from_pretrained(
 	repo_id="ggml-org/SmolVLM-500M-Instruct-GGUF",
 	filename="SmolVLM-500M-Instruct-Q8_0.gguf",
+	n_ctx=4096,
+	n_batch=2048,  # Prefill the prompt in large batches
+	n_threads=os.cpu_count(),
 )
+# Reuse the evaluated state of the fixed instruction prefix instead of re-prefilling it every turn
+llm.set_cache(LlamaRAMCache())
 
 load_dotenv(override=True)
 
+# === OLLAMA CLIENT SETUP ===
+# One client so requests share a pooled HTTP connection; keep_alive stops the daemon
+# from unloading Mistral after its 5 minute idle timeout
+ollama_client = ollama.Client(host=os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+OLLAMA_KEEP_ALIVE = "1h"
+OLLAMA_OPTIONS = {"num_ctx": 4096, "num_batch": 512, "num_thread": os.cpu_count()}
+
+# === IN-PROCESS MISTRAL ===
+# With a local GGUF, Mistral runs in this process through llama.cpp instead of over
+# Ollama's HTTP API: no request framing or JSON-encoding of the history, and the
+# prefix cache keeps the system prompt prefilled. Ollama is used when the file is absent.
+MISTRAL_GGUF_PATH = os.getenv("MISTRAL_GGUF_PATH", "mistral-7b-instruct-q4_k_m.gguf")
+mistral_llm = None
+if os.path.exists(MISTRAL_GGUF_PATH):
+    mistral_llm = Llama(
+        model_path=MISTRAL_GGUF_PATH,
+        n_ctx=8192,
+        n_gpu_layers=-1,
+        n_batch=2048,
+        n_threads=os.cpu_count(),
+        verbose=False,
+    )
+    mistral_llm.set_cache(LlamaRAMCache())
+# A Llama instance isn't thread-safe; chat and history summaries share it
+mistral_lock = threading.Lock()
+
 # === GEMINI CLIENT SETUP ===
 client = genai.Client(api_key=os.getenv("API_KEY"))  # <-- Replace with your Gemini API key
 
@@ -67,22 +101,40 @@ exit_words = ["exit", "stop", "quit", "bye", "goodbye"]
 pending_followup = None
 followup_timer = None
 
+# Only the last few turns are resent verbatim; older ones are folded into a short summary
+HISTORY_TURNS = 4
+history_summary = ""
+# Single worker so summaries are built in order, off the request path
+summary_executor = ThreadPoolExecutor(max_workers=1)
+
+# Runs the SmolVLM scene description while the rest of the turn is prepared
+vlm_executor = ThreadPoolExecutor(max_workers=1)
+
 # === CAMERA SETUP ===
 cam = cv2.VideoCapture(0)
+cam.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
+# Latest frame is kept by a background reader so get_response never waits on the camera
+frame_grabber = FrameGrabber(cam)
+frame_grabber.start()
 
-def get_frame_data():
-    ret, frame = cam.read()
-    if not ret:
+# Reused resize destination; avoids allocating a new 224x224 image per turn
+_resized_frame = np.empty((224, 224, 3), dtype=np.uint8)
+
+
+def get_frame_data() -> Optional[Tuple[memoryview, int]]:
+    """Return the JPEG-encoded frame (a view of imencode's buffer, not a copy) and a coarse hash of the scene"""
+    frame = frame_grabber.read(copy=False)
+    if frame is None:
         print("Failed to capture frame.")
         return None
-    resized = cv2.resize(frame, (224, 224))
+    resized = cv2.resize(frame, (224, 224), dst=_resized_frame)
     _, buffer = cv2.imencode('.jpg', resized)
-    return base64.b64encode(buffer).decode('utf-8')
+    return memoryview(buffer).cast('B'), scene_hash(resized)
 
 
-def get_scene_description_from_smolvlm(image_bytes: bytes) -> str:
-    encoded_image = base64.b64encode(image_bytes).decode('utf-8')
+def get_scene_description_from_smolvlm(image_bytes: memoryview) -> str:
+    encoded_image = base64.b64encode(image_bytes).decode('ascii')
     prompt = (
         "Describe the image in detail for a robot assistant.\n"
         f"<image>{encoded_image}</image>"
@@ -99,86 +151,75 @@ def get_scene_description_from_smolvlm(image_bytes: bytes) -> str:
         print("llama-cpp error:", e)
         return "Unable to describe the scene."
 
+
+# Frames whose hashes differ by at most this many bits are treated as the same scene
+SCENE_CHANGE_BITS = 4
+_last_scene = None  # (scene hash, description) of the last described frame
+
+
+def describe_scene(image_bytes: memoryview, frame_hash: int) -> str:
+    """Describe the scene with SmolVLM, reusing the last description if the view hasn't changed"""
+    global _last_scene
+    if _last_scene and hash_distance(_last_scene[0], frame_hash) <= SCENE_CHANGE_BITS:
+        print("Scene unchanged, reusing the previous description.")
+        return _last_scene[1]
+    description = get_scene_description_from_smolvlm(image_bytes)
+    if description != "Unable to describe the scene.":
+        _last_scene = (frame_hash, description)
+    return description
+
+
 # === MOTION EXECUTION SYSTEM ===
+# Motor command -> (handler, number of positional args it takes)
+MOTOR_HANDLERS = {
+    'move_up': (servo_controller.move_up, 1),
+    'move_down': (servo_controller.move_down, 1),
+    'move_forward': (servo_controller.move_forward, 1),
+    'move_backward': (servo_controller.move_backward, 1),
+    'move_left': (servo_controller.move_left, 1),
+    'move_right': (servo_controller.move_right, 1),
+    'move_servo': (servo_controller.move_servo, 2),
+}
+
+
 def execute_motion_sequence(actions: List[Dict[str, Any]]) -> bool:
-    """Execute a sequence of robot actions"""
+    """Execute a sequence of robot actions, sending the moves between waits as one batch"""
     print(f"Executing {len(actions)} actions...")
 
+    batch = []
     for i, action in enumerate(actions):
-        print(f"Action {i + 1}: {action.get('type', 'unknown')}")
+        cmd_type = action.get('type', 'unknown')
+        print(f"Action {i + 1}: {cmd_type}")
 
-        if action.get('type') == 'motor':
+        if cmd_type == 'motor':
             command = action.get('command')
-            args = action.get('args', [])
-
-            # Map commands to servo controller methods
-            if command == 'move_up' and args:
-                servo_controller.move_up(args[0])
-            elif command == 'move_down' and args:
-                servo_controller.move_down(args[0])
-            elif command == 'move_forward' and args:
-                servo_controller.move_forward(args[0])
-            elif command == 'move_backward' and args:
-                servo_controller.move_backward(args[0])
-            elif command == 'move_left' and args:
-                servo_controller.move_left(args[0])
-            elif command == 'move_right' and args:
-                servo_controller.move_right(args[0])
-            elif command == 'move_servo' and len(args) >= 2:
-                servo_controller.move_servo(args[0], args[1])
-            elif command == 'hold_position' and args:
+            args = action.get('args', ())
+
+            if command == 'hold_position' and args:
+                servo_controller.execute_batch(batch)
+                batch = []
                 servo_controller.hold_position(args[0])
+                continue
+
+            handler, arg_count = MOTOR_HANDLERS.get(command, (None, 0))
+            if handler and len(args) >= arg_count:
+                batch.append((handler, tuple(args[:arg_count])))
             else:
                 print(f"Unknown motor command: {command}")
 
-        elif action.get('type') == 'wait':
-            duration = action.get('duration', 1.0)
-            time.sleep(duration)
+        elif cmd_type == 'wait':
+            servo_controller.execute_batch(batch)
+            batch = []
+            time.sleep(action.get('duration', 1.0))
 
-        elif action.get('type') == 'vision_check':
+        elif cmd_type == 'vision_check':
             # Placeholder for vision processing
             print(f"Vision check: {action.get('target', 'general')}")
 
-        # Brief pause between actions for safety
-        time.sleep(0.1)
-
+    servo_controller.execute_batch(batch)
     return True
 
 
-def parse_ai_response(response_text: str) -> Optional[Dict[str, Any]]:
-    """Parse AI response and extract structured data"""
-    try:
-        # Look for JSON structure in the response
-        start_idx = response_text.find('{')
-        if start_idx == -1:
-            return None
-
-        # Find the matching closing brace
-        brace_count = 0
-        end_idx = -1
-        for i in range(start_idx, len(response_text)):
-            if response_text[i] == '{':
-                brace_count += 1
-            elif response_text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i
-                    break
-
-        if end_idx == -1:
-            return None
-
-        json_str = response_text[start_idx:end_idx + 1]
-        return json.loads(json_str)
-
-    except json.JSONDecodeError as e:
-        print(f"JSON parse error: {e}")
-        return None
-    except Exception as e:
-        print(f"Response parsing error: {e}")
-        return None
-
-
 def schedule_followup(followup_prompt: str, delay: float = 3.0):
     """Schedule a followup prompt after motion completion"""
     global pending_followup, followup_timer
@@ -187,8 +228,7 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
         global pending_followup
         if pending_followup:
             print(f"Follow-up: {pending_followup}")
-            engine.say(pending_followup)
-            engine.runAndWait()
+            speech.say(pending_followup)
             pending_followup = None
 
     if followup_timer:
@@ -199,16 +239,80 @@ def schedule_followup(followup_prompt: str, delay: float = 3.0):
     followup_timer.start()
 
 
+# === HISTORY MANAGEMENT ===
+def summarize_turns(old_turns: List[Dict[str, str]]):
+    """Fold evicted turns into history_summary (runs on summary_executor)"""
+    global history_summary
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old_turns)
+    earlier = f"Earlier summary: {history_summary}\n" if history_summary else ""
+    prompt = (
+        "Summarize this robot assistant conversation in under 40 words, keeping any facts "
+        f"the robot may need later.\n{earlier}{transcript}"
+    )
+    try:
+        if mistral_llm is not None:
+            with mistral_lock:
+                output = mistral_llm.create_chat_completion(
+                    messages=[{"role": "user", "content": prompt}], max_tokens=80
+                )
+            history_summary = output["choices"][0]["message"]["content"].strip()
+        else:
+            history_summary = ollama_client.generate(
+                model='mistral:latest', prompt=prompt, keep_alive=OLLAMA_KEEP_ALIVE, options=OLLAMA_OPTIONS
+            )["response"].strip()
+    except Exception as e:
+        print("Error summarizing history:", e)
+
+
+def trim_history():
+    """Keep the system prompt plus the last HISTORY_TURNS exchanges; summarize the rest"""
+    global conversation_history
+    turns = conversation_history[1:]
+    if len(turns) <= 2 * HISTORY_TURNS:
+        return
+    evicted = turns[:-2 * HISTORY_TURNS]
+    conversation_history = conversation_history[:1] + turns[-2 * HISTORY_TURNS:]
+    summary_executor.submit(summarize_turns, evicted)
+
+
+def build_messages() -> List[Dict[str, str]]:
+    """Messages to send: system prompt, summary of older turns (if any), recent turns"""
+    if not history_summary:
+        return conversation_history
+    summary = {"role": "system", "content": f"Context from earlier in the conversation: {history_summary}"}
+    return conversation_history[:1] + [summary] + conversation_history[1:]
+
+
+# === STREAMING HELPERS ===
+def stream_mistral(messages: List[Dict[str, str]]) -> Iterator[str]:
+    """Yield the reply as it is generated, constrained to a single JSON object"""
+    if mistral_llm is None:
+        stream = ollama_client.chat(model='mistral:latest', messages=messages, stream=True, format='json',
+                                    keep_alive=OLLAMA_KEEP_ALIVE, options=OLLAMA_OPTIONS)
+        for part in stream:
+            yield part["message"]["content"]
+        return
+    with mistral_lock:
+        stream = mistral_llm.create_chat_completion(messages=messages, stream=True,
+                                                    response_format={"type": "json_object"})
+        for part in stream:
+            yield part["choices"][0]["delta"].get("content") or ""
+
+
 # === ENHANCED GEMINI REQUEST FUNCTION ===
 def get_response(user_input: str) -> str:
+    """
+    Stream the Mistral reply, speaking the first sentence of the voice response as soon
+    as it arrives. Returns the part of the voice response that still needs to be spoken.
+    """
     global conversation_history
 
     # === 1. Capture camera image ===
-    frame_data = get_frame_data()
-    if not frame_data:
+    captured = get_frame_data()
+    if not captured:
         return "Camera input failed."
-    image_bytes = base64.b64decode(frame_data)
-    scene_description = get_scene_description_from_smolvlm(image_bytes)
+    # llama.cpp releases the GIL during inference, so the state read below overlaps with it
+    scene_future = vlm_executor.submit(describe_scene, *captured)
 
     # === 2. LLaVA: Visual scene description ===
     # try:
@@ -230,6 +334,8 @@ def get_response(user_input: str) -> str:
     robot_state = servo_controller.get_current_state()
     state_info = f"Current robot state: elevation_servo_pos={robot_state['elevation_servo_pos']}, translation_servo_pos={robot_state['translation_servo_pos']}, rotation_stepper_deg={robot_state['rotation_stepper_deg']}"
 
+    scene_description = scene_future.result()
+
     # === 4. Compose user message with state and scene ===
     user_message = f"""User command: {user_input}
 
@@ -251,18 +357,28 @@ def get_response(user_input: str) -> str:
         conversation_history.append({"role": "system", "content": system_prompt})
     conversation_history.append({"role": "user", "content": user_message})
 
-    # === 6. Send to Mistral via Ollama ===
+    # === 6. Stream from Mistral via Ollama ===
+    chunks = []
+    spoken_prefix = None
     try:
         print("sending to mistral")
-        response = ollama.chat(model='mistral:latest', messages=conversation_history)
-        model_reply = response["message"]["content"]
+        for text in stream_mistral(build_messages()):
+            chunks.append(text)
+            if spoken_prefix is None:
+                spoken_prefix = extract_first_sentence("".join(chunks), "voice_response")
+                if spoken_prefix:
+                    speech.say(spoken_prefix)
+        model_reply = "".join(chunks)
         print("Mistral reply:", model_reply)
     except Exception as e:
         print("Error using Mistral:", e)
         return "Failed to get a response from the language model."
 
     # === 7. Add assistant reply to history ===
+    # Later turns only need the command and state; the scene description and format block are dropped
+    conversation_history[-1] = {"role": "user", "content": f"User command: {user_input}\n{state_info}"}
     conversation_history.append({"role": "assistant", "content": model_reply})
+    trim_history()
 
     # === 8. Parse structured JSON ===
     structured_response = parse_ai_response(model_reply)
@@ -278,6 +394,8 @@ def get_response(user_input: str) -> str:
             schedule_followup(structured_response.get('followup_prompt'), 3.0)
 
         voice_response = structured_response.get('voice_response', model_reply)
+        if spoken_prefix and voice_response.startswith(spoken_prefix):
+            return voice_response[len(spoken_prefix):].strip()
         return voice_response
     else:
         return model_reply
@@ -359,11 +477,7 @@ while listening:
 
             reply = get_response(user_input)
             print("Robot:", reply)
-            engine.setProperty('rate', 200)
-            engine.setProperty('volume', volume)
-            engine.setProperty('voice', voices[0].id)
-            engine.say(reply)
-            engine.runAndWait()
+            speech.say(reply)
 
     except KeyboardInterrupt:
         print("\nInterrupted. Exiting.")
@@ -372,6 +486,10 @@ while listening:
         print(f"Unexpected error: {e}")
 
 # Cleanup
+vlm_executor.shutdown(wait=False)
+summary_executor.shutdown(wait=False)
+speech.stop()
+frame_grabber.stop()
 cam.release()
 cv2.destroyAllWindows()
 servo_controller.close()
\ No newline at end of file
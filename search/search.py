@@ -1,6 +1,8 @@
 from perplexity import Perplexity
+import httpx
 import google.genai as genai
 from google.genai.types import GenerateContentConfig
+from pydantic import BaseModel
 
 from dotenv import load_dotenv
 import os
@@ -8,11 +10,27 @@ import time
 import json
 import re
 import atexit
+import importlib.util
+import sqlite3
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Tuple
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # without it, novel queries go straight to Gemini
+    SentenceTransformer = None
 
 load_dotenv(override=True)
-client_perplexity = Perplexity(api_key=os.getenv("PERPLEXITY_API_KEY"))
+# Explicit pool so Perplexity connections (and their TLS sessions) stay open between
+# searches; HTTP/2 when the h2 package is installed. The genai client already keeps
+# its own persistent httpx client for the life of the process.
+_perplexity_http = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=60),
+    http2=importlib.util.find_spec("h2") is not None,
+)
+client_perplexity = Perplexity(api_key=os.getenv("PERPLEXITY_API_KEY"), http_client=_perplexity_http)
 
 client = genai.Client(api_key=os.getenv("API_KEY"))
 
@@ -36,10 +54,12 @@ def _extract_text(response) -> str:
 
 
 # === CACHE CONFIGURATION ===
-CACHE_FILE = Path(__file__).parent / "query_complexity_cache.json"
+CACHE_FILE = Path(__file__).parent / "query_complexity_cache.db"
+# Pre-SQLite cache; imported once into an empty database
+LEGACY_CACHE_FILE = Path(__file__).parent / "query_complexity_cache.json"
 
 # Pattern-based cache for common query types (instant, no API calls)
-QUERY_PATTERNS: Dict[str, int] = {
+_RAW_QUERY_PATTERNS: Dict[str, int] = {
     # Simple fact patterns - 100 tokens
     r'\b(what|when|where) (is|are|was) (the|a)\b.*\b(time|date|temperature|score)\b': 100,
     r'\bweather\b.*\b(today|tomorrow|tonight)\b': 100,
@@ -57,11 +77,32 @@ QUERY_PATTERNS: Dict[str, int] = {
     r'\bwhat games\b.*\b(today|tonight)\b': 250,
     r'\bmultiple\b.*\b(games|events|matches)\b': 250,
 }
+# All patterns in one compiled regex, searched once per query. Each pattern is a lookahead
+# anchored at the start, so the alternation tries them in the order listed above (the first
+# listed pattern that matches anywhere wins, as with a loop); the named group tells which.
+_PATTERN_TOKEN_LIMITS: Dict[str, int] = {
+    f"p{i}": token_limit for i, token_limit in enumerate(_RAW_QUERY_PATTERNS.values())
+}
+QUERY_PATTERN = re.compile(
+    r"\A(?:" + "|".join(
+        rf"(?=[\s\S]*?(?P<p{i}>{pattern}))" for i, pattern in enumerate(_RAW_QUERY_PATTERNS)
+    ) + ")",
+    re.IGNORECASE
+)
+
+# Fingerprint substitutions (applied to the lowercased query)
+_NUM_RE = re.compile(r'\b\d+\b')
+_DAY_RE = re.compile(r'\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b')
+_MONTH_RE = re.compile(r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\b')
+_TEAM_RE = re.compile(r'\b(warriors|lakers|kings|bulls|heat|celtics|nets|sixers|pacers|suns|nuggets|[a-z]+ers)\b')
 
 # In-memory cache (loaded from disk on startup)
-_recent_query_cache: Dict[str, Dict] = {}
+# Ordered least- to most-recently used, so LRU eviction pops from the front
+_recent_query_cache: "OrderedDict[str, Dict]" = OrderedDict()
 _cache_max_size = 100
-_cache_modified = False  # Track if cache needs saving
+# Every change is written through to SQLite as it happens (one row, not the whole file)
+_cache_db: Optional[sqlite3.Connection] = None
+_cache_db_lock = threading.Lock()
 
 try:
     # Use absolute path relative to this file's location
@@ -74,67 +115,118 @@ except FileNotFoundError:
 
 
 
+# Routing is a small classification: a cheap, non-thinking model, greedy decoding and
+# an output cap sized to the JSON object (the search itself is done by Perplexity)
+ROUTER_MODEL = "gemini-2.5-flash-lite"
+
+class SearchRoute(BaseModel):
+    needs_search: bool
+    relevant_context: Optional[str] = None
+    token_limit: int  # 100, 150 or 250
+
+
 generation_config = GenerateContentConfig(
-    temperature=0.8,
-    top_p=0.9,
-    top_k=40,
-    max_output_tokens=8192,
+    temperature=0.0,
+    max_output_tokens=256,
     system_instruction=system_prompt,
+    response_mime_type="application/json",
+    response_schema=SearchRoute,
 )
 
+# Fixed config for the fallback token-limit call, built once instead of per query
+_TOKEN_LIMIT_CFG = GenerateContentConfig(
+    temperature=0.1,
+    max_output_tokens=10,
+)
+
+VALID_TOKEN_LIMITS = (100, 150, 250)
+_NEEDS_SEARCH_TRUE_RE = re.compile(r'"needs_search"\s*:\s*true\b')
+_JSON_DECODER = json.JSONDecoder()
+
 
 # === CACHE FUNCTIONS ===
 
 def load_cache_from_disk():
-    """Load cache from disk into memory on startup"""
-    global _recent_query_cache
+    """Open the SQLite cache and load the most recent entries into memory on startup"""
+    global _cache_db, _recent_query_cache
     
-    if CACHE_FILE.exists():
-        try:
-            with open(CACHE_FILE, 'r') as f:
-                _recent_query_cache = json.load(f)
-            print(f"[Cache] Loaded {len(_recent_query_cache)} entries from disk")
-        except Exception as e:
-            print(f"[Cache] Error loading cache: {e}, starting fresh")
-            _recent_query_cache = {}
-    else:
-        print(f"[Cache] No existing cache file, starting fresh")
-        _recent_query_cache = {}
+    try:
+        _cache_db = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        _cache_db.execute("PRAGMA journal_mode=WAL")
+        _cache_db.execute("PRAGMA synchronous=NORMAL")
+        with _cache_db:
+            _cache_db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "fingerprint TEXT PRIMARY KEY, token_limit INTEGER, last_accessed REAL, example_query TEXT)"
+            )
+        _import_legacy_cache()
+        rows = _cache_db.execute(
+            "SELECT fingerprint, token_limit, last_accessed, example_query FROM cache "
+            "ORDER BY last_accessed DESC LIMIT ?",
+            (_cache_max_size,)
+        ).fetchall()
+        _recent_query_cache = OrderedDict(
+            (fingerprint, {'token_limit': token_limit, 'example_query': example})
+            for fingerprint, token_limit, _, example in reversed(rows)
+        )
+        print(f"[Cache] Loaded {len(_recent_query_cache)} entries from disk")
+    except sqlite3.Error as e:
+        print(f"[Cache] Error opening cache: {e}, caching in memory only")
+        _cache_db = None
+        _recent_query_cache = OrderedDict()
 
 
-def save_cache_to_disk():
-    """Save in-memory cache to disk"""
-    global _cache_modified
-    
-    if not _cache_modified:
-        return  # No changes to save
-    
+def _import_legacy_cache():
+    """Copy entries from the old JSON cache file into an empty database"""
+    if not LEGACY_CACHE_FILE.exists() or _cache_db.execute("SELECT 1 FROM cache LIMIT 1").fetchone():
+        return
     try:
-        with open(CACHE_FILE, 'w') as f:
-            json.dump(_recent_query_cache, f, indent=2)
-        _cache_modified = False
-        print(f"[Cache] Saved {len(_recent_query_cache)} entries to disk")
-    except Exception as e:
+        with open(LEGACY_CACHE_FILE, 'r') as f:
+            entries = json.load(f)
+        with _cache_db:
+            _cache_db.executemany(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                [(fp, e['token_limit'], e['last_accessed'], e.get('example_query')) for fp, e in entries.items()]
+            )
+        print(f"[Cache] Imported {len(entries)} entries from {LEGACY_CACHE_FILE.name}")
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        print(f"[Cache] Error importing legacy cache: {e}")
+
+
+def _write_cache(sql: str, params) -> None:
+    """Run one statement against the cache database and commit it"""
+    if _cache_db is None:
+        return
+    try:
+        with _cache_db_lock, _cache_db:
+            _cache_db.execute(sql, params)
+    except sqlite3.Error as e:
         print(f"[Cache] Error saving cache: {e}")
 
 
+def close_cache():
+    """Close the cache database (registered with atexit)"""
+    if _cache_db is not None:
+        with _cache_db_lock:
+            _cache_db.close()
+
+
 def get_query_fingerprint(query: str) -> str:
     """Create a fingerprint for similar queries"""
-    fingerprint = re.sub(r'\b\d+\b', 'NUM', query.lower())
-    fingerprint = re.sub(r'\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b', 'DAY', fingerprint)
-    fingerprint = re.sub(r'\b(january|february|march|april|may|june|july|august|september|october|november|december)\b', 'MONTH', fingerprint)
-    fingerprint = re.sub(r'\b(warriors|lakers|kings|bulls|heat|celtics|nets|sixers|pacers|suns|nuggets|[a-z]+ers)\b', 'TEAM', fingerprint)
+    fingerprint = _NUM_RE.sub('NUM', query.lower())
+    fingerprint = _DAY_RE.sub('DAY', fingerprint)
+    fingerprint = _MONTH_RE.sub('MONTH', fingerprint)
+    fingerprint = _TEAM_RE.sub('TEAM', fingerprint)
     return fingerprint
 
 
 def check_pattern_cache(query: str) -> Tuple[bool, int]:
     """Check if query matches any pre-defined patterns"""
-    query_lower = query.lower()
-    
-    for pattern, token_limit in QUERY_PATTERNS.items():
-        if re.search(pattern, query_lower):
-            print(f"[Cache] Pattern match: {token_limit} tokens")
-            return True, token_limit
+    match = QUERY_PATTERN.match(query)
+    if match:
+        token_limit = _PATTERN_TOKEN_LIMITS[match.lastgroup]
+        print(f"[Cache] Pattern match: {token_limit} tokens")
+        return True, token_limit
     
     return False, 0
 
@@ -147,8 +239,10 @@ def check_recent_cache(query: str) -> Tuple[bool, int]:
         cache_entry = _recent_query_cache[fingerprint]
         token_limit = cache_entry['token_limit']
         
-        # Update last accessed time (for LRU tracking)
-        cache_entry['last_accessed'] = time.time()
+        # Mark as most recently used; the stored timestamp orders entries on the next load
+        _recent_query_cache.move_to_end(fingerprint)
+        _write_cache("UPDATE cache SET last_accessed = ? WHERE fingerprint = ?",
+                     (time.time(), fingerprint))
         
         print(f"[Cache] Recent query match: {token_limit} tokens")
         return True, token_limit
@@ -157,54 +251,148 @@ def check_recent_cache(query: str) -> Tuple[bool, int]:
 
 
 def cache_query_result(query: str, token_limit: int):
-    """Store query result in recent cache and mark for disk sync"""
-    global _recent_query_cache, _cache_modified
+    """Store query result in recent cache and write it to disk"""
+    global _recent_query_cache
     
     fingerprint = get_query_fingerprint(query)
     
     _recent_query_cache[fingerprint] = {
         'token_limit': token_limit,
-        'last_accessed': time.time(),
         'example_query': query  # Store one example for debugging
     }
-    
-    _cache_modified = True
+    _recent_query_cache.move_to_end(fingerprint)
+    _write_cache("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                 (fingerprint, token_limit, time.time(), query))
     
     # Implement LRU: keep only most recent N items
-    if len(_recent_query_cache) > _cache_max_size:
-        # Sort by last_accessed and remove oldest
-        sorted_entries = sorted(
-            _recent_query_cache.items(),
-            key=lambda x: x[1]['last_accessed']
-        )
-        # Remove oldest 10% to avoid frequent pruning
-        num_to_remove = _cache_max_size // 10
-        for fingerprint, _ in sorted_entries[:num_to_remove]:
-            del _recent_query_cache[fingerprint]
-        print(f"[Cache] Pruned {num_to_remove} old entries")
+    while len(_recent_query_cache) > _cache_max_size:
+        evicted, _ = _recent_query_cache.popitem(last=False)
+        _write_cache("DELETE FROM cache WHERE fingerprint = ?", (evicted,))
 
 
-def determine_search_token_limit(query: str) -> int:
+def lookup_cached_token_limit(query: str) -> Optional[int]:
     """
-    Use multi-level caching + Gemini to determine optimal token limit.
+    Token limit from the caches alone (no API calls), or None on a miss.
+    Only called on the path where a search is already happening (search() without a
+    limit), so caching a pattern hit here records a confirmed search.
     
     Cache levels:
-    1. Pattern cache (instant, regex-based)
-    2. Persistent fingerprint cache (in-memory, loaded from disk)
-    3. Gemini analysis (fallback for novel queries)
+    1. Persistent fingerprint cache (in-memory dict lookup, loaded from disk)
+    2. Pattern cache (regex-based; hits are added to the fingerprint cache)
     """
     
-    # Level 1: Check pattern cache
-    found, token_limit = check_pattern_cache(query)
+    # Level 1: Check persistent cache (in-memory)
+    found, token_limit = check_recent_cache(query)
     if found:
         return token_limit
     
-    # Level 2: Check persistent cache (in-memory)
-    found, token_limit = check_recent_cache(query)
+    # Level 2: Check pattern cache
+    found, token_limit = check_pattern_cache(query)
     if found:
+        # Similar queries will now hit the dict lookup instead of rescanning the patterns
+        cache_query_result(query, token_limit)
+        return token_limit
+    
+    return None
+
+
+# === LOCAL TOKEN-LIMIT CLASSIFIER ===
+# Nearest-neighbour vote over labelled queries (these seeds plus every cached example),
+# used before falling back to Gemini for a novel query
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+_SEED_EXAMPLES: List[Tuple[str, int]] = [
+    ("what's the weather tomorrow", 100),
+    ("what time does the store close", 100),
+    ("what is the temperature outside", 100),
+    ("what was the score of the game last night", 100),
+    ("what channel is the game on", 100),
+    ("what's the price of bitcoin right now", 100),
+    ("who is playing tonight", 150),
+    ("when is the next warriors game", 150),
+    ("what's the schedule for the concert this weekend", 150),
+    ("compare the forecast for today and tomorrow", 150),
+    ("what movies are playing near me", 150),
+    ("what are all the games today", 250),
+    ("give me the full nba schedule for this week", 250),
+    ("what are the biggest news stories today", 250),
+    ("list every event happening downtown this weekend", 250),
+    ("summarize the latest news on the election", 250),
+]
+_KNN_K = 5
+_KNN_MIN_SIMILARITY = 0.6
+_KNN_MIN_CONFIDENCE = 0.8
+
+# Seeds plus the fingerprint cache are at most ~120 texts; the bound only matters as
+# example queries rotate through the cache
+_EMBEDDING_CACHE_SIZE = 256
+
+_embedder = None
+_example_embeddings: "OrderedDict[str, Any]" = OrderedDict()
+
+
+def _embed(text: str):
+    if text in _example_embeddings:
+        _example_embeddings.move_to_end(text)
+    else:
+        _example_embeddings[text] = _embedder.encode(text, normalize_embeddings=True)
+        while len(_example_embeddings) > _EMBEDDING_CACHE_SIZE:
+            _example_embeddings.popitem(last=False)
+    return _example_embeddings[text]
+
+
+def classify_token_limit(query: str) -> Optional[int]:
+    """
+    Predict the token limit locally from the most similar labelled queries.
+    Returns None when sentence-transformers is unavailable or the vote isn't confident.
+    """
+    global _embedder
+    if SentenceTransformer is None:
+        return None
+    if _embedder is None:
+        _embedder = SentenceTransformer(EMBEDDING_MODEL)
+    
+    examples = dict(_SEED_EXAMPLES)
+    for entry in list(_recent_query_cache.values()):
+        if entry.get('example_query'):
+            examples[entry['example_query']] = entry['token_limit']
+    
+    query_embedding = _embedder.encode(query, normalize_embeddings=True)
+    scored = sorted(
+        ((float(_embed(text) @ query_embedding), token_limit) for text, token_limit in examples.items()),
+        reverse=True
+    )[:_KNN_K]
+    neighbours = [(score, token_limit) for score, token_limit in scored if score >= _KNN_MIN_SIMILARITY]
+    if not neighbours:
+        return None
+    
+    votes: Dict[int, float] = {}
+    for score, token_limit in neighbours:
+        votes[token_limit] = votes.get(token_limit, 0.0) + score
+    token_limit, weight = max(votes.items(), key=lambda item: item[1])
+    if weight / sum(votes.values()) < _KNN_MIN_CONFIDENCE:
+        return None
+    print(f"[Classifier] Predicted: {token_limit} tokens")
+    return token_limit
+
+
+def determine_search_token_limit(query: str) -> int:
+    """
+    Use multi-level caching + Gemini to determine optimal token limit.
+    Levels 1-2 are lookup_cached_token_limit; level 3 is the local classifier, and
+    Gemini analysis is the fallback for novel queries it isn't confident about.
+    """
+    
+    token_limit = lookup_cached_token_limit(query)
+    if token_limit is not None:
         return token_limit
     
-    # Level 3: Ask Gemini (cache miss)
+    # Level 3: Local nearest-neighbour classifier
+    token_limit = classify_token_limit(query)
+    if token_limit is not None:
+        cache_query_result(query, token_limit)
+        return token_limit
+    
+    # Level 4: Ask Gemini (cache miss)
     print(f"[Cache] Miss - querying Gemini for complexity analysis")
     
     analysis_prompt = f"""Analyze this search query and determine the optimal response length needed:
@@ -220,24 +408,16 @@ Respond with ONLY the number: 100, 150, or 250"""
 
     try:
         response = client.models.generate_content(
-            model="gemini-3-flash-preview",
+            model=ROUTER_MODEL,
             contents=analysis_prompt,
-            config=GenerateContentConfig(
-                temperature=0.1,
-                max_output_tokens=10,
-            )
+            config=_TOKEN_LIMIT_CFG
         )
         
         token_limit = int(_extract_text(response))
         
-        if token_limit in [100, 150, 250]:
+        if token_limit in VALID_TOKEN_LIMITS:
             cache_query_result(query, token_limit)
             print(f"[Gemini Router] Determined: {token_limit} tokens (cached)")
-            
-            # Save to disk immediately to ensure persistence
-            # (Low overhead since this only runs on cache misses)
-            save_cache_to_disk()
-            
             return token_limit
         else:
             print(f"[Gemini Router] Unexpected value {token_limit}, defaulting to 150")
@@ -248,92 +428,90 @@ Respond with ONLY the number: 100, 150, or 250"""
         return 150
 
 
-def extract_relevant_context(query, conversation_history):
+def route_query(query: str, conversation_context=None) -> Dict[str, Any]:
     """
-    Use Gemini to extract only relevant context from conversation history
+    One Gemini call that decides whether a search is needed, extracts the relevant
+    conversation context and estimates the token limit (see search_sys_prompt.txt).
     """
-    print(f"[Context extraction] Conversation history: {conversation_history}")
-    if not conversation_history or len(conversation_history) == 0:
-        return None
-    
-    # Build a prompt asking Gemini to extract relevant context
-    context_prompt = f"""Given the current user query: "{query}"
-
-Extract ONLY the relevant information from the conversation history that would help answer this query. 
-Return ONLY the key facts, names, or topics from previous messages. Keep it brief.
-If no relevant context exists, return "None"
-
-Conversation history:
-{json.dumps(conversation_history[-4:], indent=2)}"""
-    
-    try:
-        response = client.models.generate_content(
-            model="gemini-3-flash-preview",
-            contents=context_prompt,
-            config=GenerateContentConfig(
-                temperature=0.3,  # Lower temperature for more focused extraction
-                max_output_tokens=200,
-            )
-                
-        )
-        
-        # Check if response has text content
-        result = _extract_text(response)
-        if not result:
-            print("[Context extraction] No text in response")
-            return None
-        print(f"[Context extraction] Extracted: {result[:100]}...")
-        return result if result.lower() != "none" else None
-    except Exception as e:
-        print(f"Error extracting context: {e}")
-        return None
-
-
-def validate_search_need(query, conversation_context=None):
-    # Check if conversation_context is a list (conversation history) or string (old format)
-    relevant_context = None
-    validation_prompt = query
-    
+    routing_prompt = f"Current user query: {query}"
     if conversation_context:
         if isinstance(conversation_context, list):
-            # Extract only relevant context from conversation
-            relevant_context = extract_relevant_context(query, conversation_context)
-            # Build validation prompt with full context to determine if search is needed
-            validation_prompt = f"Previous conversation: {json.dumps(conversation_context[-2:], indent=2)}\n\nCurrent user query: {query}"
+            routing_prompt = f"Conversation history:\n{json.dumps(conversation_context[-4:])}\n\n{routing_prompt}"
         else:
             # Old format: string context (backward compatibility)
-            relevant_context = conversation_context
-            validation_prompt = f"Previous conversation context: {conversation_context}\n\nCurrent user query: {query}"
+            routing_prompt = f"Previous conversation context: {conversation_context}\n\n{routing_prompt}"
     
-    # Ask Gemini if search is needed (using full conversation context)
     response = client.models.generate_content(
-        model="gemini-3-flash-preview",
-        contents=validation_prompt,
+        model=ROUTER_MODEL,
+        contents=routing_prompt,
         config=generation_config
     )
     
-    if "Yes" in _extract_text(response):
-        # Build search query: only include context if it's actually relevant
-        if relevant_context:
-            # Context is relevant - enrich the search query
-            search_query = f"{relevant_context}\n\n{query}"
-            print(f"[Search] Using enriched query with context")
-        else:
-            # No relevant context - search with clean query
-            search_query = query
-            print(f"[Search] Using clean query (no relevant context)")
-        
-        return (True, search(search_query))
+    parsed = getattr(response, "parsed", None)
+    if isinstance(parsed, SearchRoute):
+        route = parsed.model_dump()
     else:
+        text = _extract_text(response)
+        try:
+            # raw_decode tolerates a code fence or trailing text around the object
+            route, _ = _JSON_DECODER.raw_decode(text, text.index('{'))
+        except ValueError:
+            # e.g. a reply cut off mid-object: only an explicit true counts
+            print(f"[Router] Unparseable response: {text[:100]}")
+            route = {"needs_search": bool(_NEEDS_SEARCH_TRUE_RE.search(text))}
+    print(f"[Router] {route}")
+    return route
+
+
+def validate_search_need(query, conversation_context=None):
+    # The caches only suggest a token limit; Perplexity is paid per request, so nothing is
+    # searched until the router has decided a search is needed
+    confirmed, cached_token_limit = check_recent_cache(query)
+    if not confirmed:
+        matched, pattern_token_limit = check_pattern_cache(query)
+        cached_token_limit = pattern_token_limit if matched else None
+    route = route_query(query, conversation_context)
+    
+    # Only a real JSON true; a string like "false" must not count
+    if route.get("needs_search") is not True:
         return (False, "")
+    
+    token_limit = cached_token_limit
+    if token_limit is None:
+        token_limit = route.get("token_limit")
+        if token_limit not in VALID_TOKEN_LIMITS:
+            # Router left it out or gave an odd value: ask the local classifier before defaulting
+            token_limit = classify_token_limit(query) or 150
+    if not confirmed:
+        # The router confirmed a search; remember the token limit for this query type
+        cache_query_result(query, token_limit)
+    
+    # Old string-format context is used as-is; history is reduced to what the router extracted
+    if conversation_context and not isinstance(conversation_context, list):
+        relevant_context = conversation_context
+    else:
+        relevant_context = route.get("relevant_context")
+    
+    # Build search query: only include context if it's actually relevant
+    if relevant_context and str(relevant_context).lower() != "none":
+        # Context is relevant - enrich the search query
+        search_query = f"{relevant_context}\n\n{query}"
+        print(f"[Search] Using enriched query with context")
+    else:
+        # No relevant context - search with clean query
+        search_query = query
+        print(f"[Search] Using clean query (no relevant context)")
+    
+    return (True, search(search_query, token_limit))
 
 
-def search(query):
+def search(query, max_tokens: Optional[int] = None):
     """
     Perform web search with dynamically determined token limit based on query complexity
+    (unless the caller already knows it)
     """
-    # Dynamically determine optimal token limit
-    max_tokens = determine_search_token_limit(query)
+    if max_tokens is None:
+        max_tokens = determine_search_token_limit(query)
     
     completion = client_perplexity.chat.completions.create(
         model="sonar",
@@ -359,8 +537,8 @@ def search(query):
 # Load cache from disk when module is imported
 load_cache_from_disk()
 
-# Register cleanup handler to save cache on program exit
-atexit.register(save_cache_to_disk)
+# Register cleanup handler to close the cache database on program exit
+atexit.register(close_cache)
 
 # print("start")
 # start_time = time.time()
@@ -12,7 +12,6 @@ import google.genai as genai
 from google.genai.types import GenerateContentConfig
 from pydantic import BaseModel
 import os
-import threading
 
 from agents.ServoController import ServoController
 
@@ -132,13 +131,10 @@ Execute this scheduled command now.
             # Execute actions
             if result.act:
                 try:
-                    from agents.robot_actions import translate_actions, execute_motion_sequence
+                    from agents.robot_actions import translate_actions, queue_motion_sequence
                     translated = translate_actions(result.act)
                     if translated:
-                        threading.Thread(
-                            target=execute_motion_sequence, 
-                            args=(translated, self.servo_controller)
-                        ).start()
+                        queue_motion_sequence(translated, self.servo_controller)
                         time.sleep(0.5)  # Brief delay for movements to start
                 except Exception as e:
                     print(f"⚠️  Error executing movements: {e}")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Tests for the reply parsing helpers shared by the agents and local experiments
+"""
+import sys
+import os
+# Add project root to Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from agents.reply_parsing import command_id, extract_first_sentence, parse_ai_response
+
+
+def test_command_id():
+    """Integral floats are accepted; bools, fractions and out-of-range ids are not"""
+    assert command_id(2, 5) == 2
+    assert command_id(2.0, 5) == 2
+    assert isinstance(command_id(2.0, 5), int)
+    assert command_id(True, 5) is None
+    assert command_id(False, 5) is None
+    assert command_id(2.5, 5) is None
+    assert command_id(5, 5) is None
+    assert command_id(-1, 5) is None
+    assert command_id("2", 5) is None
+
+
+def test_parse_ai_response():
+    """The first JSON object is found despite surrounding text and nested braces"""
+    reply = 'Sure! ```json\n{"vr": "Hi {there}", "act": [[1, 2.0]], "meta": {"a": {"b": 1}}}\n``` Done.'
+    assert parse_ai_response(reply) == {"vr": "Hi {there}", "act": [[1, 2.0]], "meta": {"a": {"b": 1}}}
+
+    # A second object after the first defeats the find/rfind slice, so raw_decode takes over
+    reply = 'prefix {"vr": "one", "fu": false} and then {"vr": "two"} suffix'
+    assert parse_ai_response(reply) == {"vr": "one", "fu": False}
+
+    assert parse_ai_response("no json here") is None
+    assert parse_ai_response('{"vr": "unterminated') is None
+
+
+def test_extract_first_sentence():
+    """A sentence is returned only once it has fully streamed in"""
+    assert extract_first_sentence('{"v') is None
+    assert extract_first_sentence('{"vr": "Turning left') is None
+    assert extract_first_sentence('{"vr": "Turning left now. Then') == "Turning left now."
+    assert extract_first_sentence('{"vr": "Okay"') == "Okay"
+    assert extract_first_sentence('{"vr": "Say \\"hi\\"! Then') == 'Say "hi"!'
+    assert extract_first_sentence('{"voice_response": "Done. Next', "voice_response") == "Done."
+
+
+if __name__ == "__main__":
+    test_command_id()
+    test_parse_ai_response()
+    test_extract_first_sentence()
+    print("✅ All reply parsing tests passed!")